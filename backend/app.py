@@ -0,0 +1,314 @@
+"""
+HTTP service for face analysis and palette generation.
+
+Run from the repository root:
+    uvicorn backend.app:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse
+from openai import OpenAI
+from pydantic import BaseModel, Field
+
+from chat_llm.chat_handler import ChatHandler, PaletteResult
+from chat_llm.harmony import get_engine
+from chat_llm.palette_cache import PaletteCache
+from chat_llm.palettes import format_palette, parse_palette_text
+from chat_llm.scheduler import RateLimitScheduler
+from faceRecModule.cache import AnalysisCache, analyse_image, analysis_key, content_key
+from faceRecModule.faceFeature import NoFaceError
+from faceRecModule.models import get_registry
+from faceRecModule.prefork import PreforkPool, WorkerCrashed, process_memory
+from faceRecModule.quality import QualityError
+from faceRecModule.regions import FEATURE_NAMES, bgr_to_hex
+from metrics import SlowRequestProfiler, get_metrics, log_event
+
+load_dotenv(".env")
+
+# Threads running face analysis; each one is busy for the whole analysis.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+# Analyses allowed to wait for a worker before new ones get a 429.
+ANALYSIS_QUEUE = int(os.getenv("ANALYSIS_QUEUE", 2 * ANALYSIS_WORKERS))
+# "threads" runs analyses in this process; "prefork" in forked worker
+# processes that share the models loaded here.
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "threads")
+# Prefork workers are replaced after this many analyses, or once their
+# private memory exceeds WORKER_MAX_PRIVATE_MB (0 disables either limit).
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", 1000))
+WORKER_MAX_PRIVATE_MB = int(os.getenv("WORKER_MAX_PRIVATE_MB", 0))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 16 * 1024 * 1024))
+# Room for the multipart boundaries and part headers around the image.
+MULTIPART_OVERHEAD = 64 * 1024
+DETECT_SIZE = int(os.getenv("DETECT_SIZE", 1024))
+# Reject blurred, badly lit or faceless uploads before the full analysis.
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1").lower() not in ("0", "false", "no")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# Account quota shared by every request of this process.
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", 3500))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", 90_000))
+# Analyses slower than this many seconds log a sampled profile; 0 disables profiling.
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", 0))
+
+
+class BoundedExecutor:
+    """
+    Thread pool that refuses work instead of queueing without limit.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self.capacity = max_workers + max_queue
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def try_submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn on the pool.
+
+        Returns:
+            asyncio.Future: The result, or None if the pool is saturated.
+        """
+        with self._lock:
+            if self.pending >= self.capacity:
+                return None
+            self.pending += 1
+
+        def run():
+            try:
+                if PROFILE_SLOW_SECONDS:
+                    with SlowRequestProfiler(fn.__name__, threshold=PROFILE_SLOW_SECONDS):
+                        return fn(*args, **kwargs)
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.pending -= 1
+
+        return asyncio.get_running_loop().run_in_executor(self.pool, run)
+
+
+class BodyLimit:
+    """
+    ASGI middleware that refuses request bodies larger than max_bytes before they are parsed.
+
+    A declared Content-Length is checked up front; a body without one is
+    counted as it arrives and fails as soon as it crosses the limit, so an
+    oversized upload is never spooled in full.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        detail = f"request body exceeds {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+if ANALYSIS_MODE == "prefork":
+    executor = PreforkPool(
+        ANALYSIS_WORKERS,
+        ANALYSIS_QUEUE,
+        max_jobs=WORKER_MAX_JOBS,
+        max_private=WORKER_MAX_PRIVATE_MB * 1024 * 1024 or None,
+    )
+else:
+    executor = BoundedExecutor(ANALYSIS_WORKERS, ANALYSIS_QUEUE)
+analysis_cache = AnalysisCache(path=".cache/analysis.sqlite")
+palette_cache = PaletteCache(path=".cache/palettes.sqlite")
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+llm_scheduler = RateLimitScheduler(OPENAI_RPM, OPENAI_TPM)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if ANALYSIS_MODE == "prefork":
+        # The first workers are forked before the server starts its other
+        # threads; replacements are forked later by the pool's dispatcher
+        # thread, see faceRecModule.prefork for why that is safe.
+        executor.start()
+        yield
+        executor.close()
+        return
+    await asyncio.get_running_loop().run_in_executor(executor.pool, get_registry().warm_up)
+    yield
+    executor.pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="Personal Color Assistant", lifespan=lifespan)
+app.add_middleware(BodyLimit, max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD)
+
+
+class RegionColour(BaseModel):
+    hex: str
+    bgr: List[int]
+    lab: List[int]
+
+
+class AnalysisResponse(BaseModel):
+    key: str
+    landmarks: List[List[int]]
+    colours: dict
+
+
+class PalettesRequest(BaseModel):
+    hexcodes: List[Annotated[str, Field(pattern=r"^#[0-9a-fA-F]{6}$")]] = Field(
+        ..., min_length=5, max_length=5, description="Left eye, right eye, nose, jaw and lips."
+    )
+    combined: bool = False
+    seed: bool = Field(False, description="Fix the colours locally; the model only writes rationales.")
+    local: bool = Field(False, description="Answer from the local harmony engine without calling the model.")
+
+
+class PaletteEntryModel(BaseModel):
+    hex: str
+    name: str
+    rationale: str
+
+
+class PaletteModel(BaseModel):
+    kind: str
+    entries: List[PaletteEntryModel]
+    content: Optional[str]
+    error: Optional[str]
+
+
+class PalettesResponse(BaseModel):
+    palettes: List[PaletteModel]
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if not get_registry().is_loaded():
+        raise HTTPException(status_code=503, detail="models are loading")
+    return {"status": "ready", "pending_analyses": executor.pending}
+
+
+@app.get("/workers")
+async def workers():
+    master = dict(pid=os.getpid(), **process_memory(os.getpid()))
+    if ANALYSIS_MODE != "prefork":
+        return {"mode": ANALYSIS_MODE, "master": master, "workers": []}
+    return {
+        "mode": ANALYSIS_MODE,
+        "master": master,
+        "restarts": executor.restarts,
+        "workers": [worker._asdict() for worker in executor.stats()],
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return get_metrics().prometheus_text()
+
+
+@app.post("/analyze", response_model=AnalysisResponse)
+async def analyze(image: UploadFile = File(...)):
+    data = await image.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"image exceeds {MAX_UPLOAD_BYTES} bytes")
+    if not data:
+        raise HTTPException(status_code=400, detail="empty upload")
+
+    # The cache stays in this process; only misses go to the analysis workers.
+    key = analysis_key(data, detect_size=DETECT_SIZE)
+    entry = await asyncio.to_thread(analysis_cache.get, key)
+    if entry is None:
+        future = executor.try_submit(analyse_image, data, gate=QUALITY_GATE, detect_size=DETECT_SIZE)
+        if future is None:
+            get_metrics().inc("analysis_rejected_total", reason="saturated")
+            raise HTTPException(status_code=429, detail="analysis queue is full", headers={"Retry-After": "1"})
+        try:
+            landmarks, stats = await future
+        except QualityError as e:
+            raise HTTPException(
+                status_code=422,
+                detail={"error": "quality", "issues": [issue._asdict() for issue in e.report.issues]},
+            )
+        except NoFaceError:
+            raise HTTPException(status_code=422, detail="no face found")
+        except WorkerCrashed:
+            raise HTTPException(status_code=500, detail="analysis worker crashed")
+        except Exception as e:
+            log_event("analysis_error", error=repr(e), traceback=traceback.format_exc())
+            raise HTTPException(status_code=500, detail="face analysis failed")
+        entry = await asyncio.to_thread(analysis_cache.put, key, landmarks, stats)
+    landmarks, stats = entry
+
+    hexcodes = bgr_to_hex(stats[:, :3])
+    return AnalysisResponse(
+        key=content_key(data),
+        landmarks=landmarks.tolist(),
+        colours={
+            name: RegionColour(hex=hexcodes[i], bgr=stats[i, :3].tolist(), lab=stats[i, 3:].tolist())
+            for i, name in enumerate(FEATURE_NAMES)
+        },
+    )
+
+
+@app.post("/palettes", response_model=PalettesResponse)
+async def palettes(request: PalettesRequest):
+    handler = ChatHandler(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        hexcodes=tuple(request.hexcodes),
+        cache=palette_cache,
+        client=openai_client,
+        scheduler=llm_scheduler,
+        harmony=get_engine(),
+        seed=request.seed,
+    )
+    if request.local:
+        results = [
+            PaletteResult(kind, format_palette(entries), None, 0.0, entries)
+            for kind, entries in handler.local_palettes().items()
+        ]
+    elif request.combined:
+        results = await handler.get_palettes_combined_async(LLM_TIMEOUT)
+    else:
+        results = await handler.get_palettes_async(LLM_TIMEOUT)
+
+    return PalettesResponse(
+        palettes=[
+            PaletteModel(
+                kind=result.kind,
+                entries=[
+                    PaletteEntryModel(hex=entry.hex, name=entry.name, rationale=entry.rationale)
+                    for entry in (result.entries or parse_palette_text(result.content or ""))
+                ],
+                content=result.content,
+                error=result.error,
+            )
+            for result in results
+        ]
+    )
@@ -0,0 +1,194 @@
+"""
+Minimal OpenAI-compatible chat completions server for benchmarks and local testing.
+
+Usage:
+    python -m benchmarks.mock_openai --port 8099 --latency 0.5
+    ChatHandler(api_key="test", hexcodes=..., base_url="http://127.0.0.1:8099/v1")
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PALETTE_TEXT = "\n".join(
+    [
+        "1. #f4e1cb (peach): Peach complements your warm facial features.",
+        "2. #4b86b4 (steel blue): Steel blue will enhance the cool tones in your eyes.",
+        "3. #f9c1bb (coral pink): Coral pink will bring out the rosy tones in your lips.",
+        "4. #82647a (mauve): Mauve will complement the subtle tones in your nose and jaw.",
+        "5. #ffd966 (mustard yellow): Mustard yellow will add a touch of sunshine.",
+    ]
+)
+
+PALETTES_JSON = json.dumps(
+    {
+        kind: [
+            {"hex": hexcode, "name": name, "rationale": "Mock rationale."}
+            for hexcode, name in [
+                ("#f4e1cb", "peach"),
+                ("#4b86b4", "steel blue"),
+                ("#f9c1bb", "coral pink"),
+                ("#82647a", "mauve"),
+                ("#ffd966", "mustard yellow"),
+            ]
+        ]
+        for kind in ("good", "bad", "blush")
+    }
+)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering /v1/chat/completions after a fixed latency.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, address=("127.0.0.1", 0), latency=0.0, token_delay=0.0, rate_limit_every=0, retry_after=0.1
+    ):
+        """
+        Args:
+            address (tuple): (host, port); port 0 picks a free port.
+            latency (float): Seconds before the first byte of each response.
+            token_delay (float): Seconds between streamed chunks.
+            rate_limit_every (int): Answer every Nth request with a 429; 0 disables.
+            retry_after (float): Retry-After seconds sent with a 429.
+        """
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """
+        Serve on a daemon thread.
+
+        Returns:
+            MockOpenAIServer: The server itself.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count_request(self):
+        """
+        Count a request.
+
+        Returns:
+            bool: True if this request should be answered with a 429.
+        """
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every > 0 and self.requests % self.rate_limit_every == 0
+            self.rate_limited += limited
+            return limited
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _usage(self, body):
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": 150, "total_tokens": prompt_tokens + 150}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.server.count_request():
+            payload = json.dumps(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            ).encode()
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("Retry-After", f"{self.server.retry_after:g}")
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        time.sleep(self.server.latency)
+
+        response_format = body.get("response_format") or {}
+        content = PALETTES_JSON if response_format.get("type") == "json_schema" else PALETTE_TEXT
+        model = body.get("model", "mock")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            payload = json.dumps(
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": self._usage(body),
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for line in content.splitlines(keepends=True):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": line}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": self._usage(body),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+    server = MockOpenAIServer(
+        (args.host, args.port), args.latency, args.token_delay, args.rate_limit_every, args.retry_after
+    )
+    print(f"serving on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Stage-by-stage benchmark of the CV pipeline and the LLM palette fan-out.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --face face.jpg --baseline other.json
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --face face.jpg --labelled 300w/ --detectors yunet dnn
+
+Without --face, fixtures are synthesized: detector and decode timings are
+still representative, and the predictor and colour stages run on fixed
+face boxes. With --face, that photo is tiled into each fixture so the
+detector finds the requested number of faces. Stages that need models
+which cannot be loaded are skipped, and the colour stage then runs on a
+template landmark layout fitted to each face box.
+
+Every run is compared against benchmarks/baseline.json (or --baseline)
+and exits non-zero if a stage's median regressed by more than
+--tolerance. Refresh the committed baseline with --save-baseline after an
+intended change, on the machine the comparison runs on.
+
+The batch stage times faceRecModule.batch.extract_batch on 1, 2 and 4
+threads and worker processes; only a machine with at least four cores
+shows how each scales.
+
+Every available detector and landmarker pair is also timed end to end.
+With --labelled, a directory of images with iBUG .pts annotations (e.g.
+300-W), each pair's detection rate and landmark error are measured too.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.mock_openai import PALETTE_TEXT, MockOpenAIServer
+from chat_llm.chat_handler import ChatHandler, hexcode_from_text, hexcode_remover_from_text
+from chat_llm.harmony import HarmonyEngine
+from chat_llm.palettes import parse_palette_text
+from chat_llm.scheduler import RateLimitScheduler
+from faceRecModule.backends import DETECTORS, LANDMARKERS
+from faceRecModule.batch import extract_batch
+from faceRecModule.decode import load_image
+from faceRecModule.faceFeature import FaceFeatures
+from faceRecModule.models import ModelRegistry, get_registry
+from faceRecModule.pyramid_compare import landmark_error
+from faceRecModule.regions import region_statistics
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SIZES = {"480p": (640, 480), "1080p": (1920, 1080), "4k": (3840, 2160)}
+FACE_COUNTS = (1, 4)
+BATCH_IMAGES = 16
+BATCH_WORKERS = (1, 2, 4)
+HEXCODES = ("#dfb8aa", "#c39e8e", "#d09d82", "#e4c1ad", "#c34a5b")
+
+
+def timeit(fn, repeat):
+    """
+    Run fn repeat times after one warm-up call.
+
+    Returns:
+        dict: median and p90 wall time in milliseconds.
+    """
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples),
+        "p90_ms": samples[min(int(len(samples) * 0.9), len(samples) - 1)],
+        "runs": repeat,
+    }
+
+
+def make_fixture(size, faces, face=None, seed=0):
+    """
+    Build a BGR test image with faces tiled along one row.
+
+    Returns:
+        tuple: (image, boxes) where boxes are (left, top, right, bottom) per face.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    side = min(width // faces, height) * 3 // 4
+    boxes = []
+    for i in range(faces):
+        x = i * (width // faces) + (width // faces - side) // 2
+        y = (height - side) // 2
+        if face is not None:
+            img[y:y + side, x:x + side] = cv2.resize(face, (side, side), interpolation=cv2.INTER_AREA)
+        else:
+            cv2.ellipse(img, (x + side // 2, y + side // 2), (side // 3, side // 2 - 2), 0, 0, 360, (140, 170, 210), -1)
+        boxes.append((x + side // 8, y + side // 8, x + side * 7 // 8, y + side * 7 // 8))
+    return img, boxes
+
+
+def template_landmarks(box):
+    """
+    A rough frontal 68-point layout (iBUG order) scaled into a face box,
+    for timing the colour stage when no landmark model is available.
+
+    Returns:
+        numpy.ndarray: (68, 2) int array of points.
+    """
+    left, top, right, bottom = box
+    angles = np.linspace(np.pi, 0, 17)
+    jaw = np.stack([0.5 - 0.5 * np.cos(angles), 0.3 + 0.65 * np.sin(angles)], axis=1)
+    brows = [(0.15 + 0.07 * i, 0.25) for i in range(5)] + [(0.57 + 0.07 * i, 0.25) for i in range(5)]
+    nose = [(0.5, 0.3 + 0.06 * i) for i in range(4)] + [(0.4 + 0.05 * i, 0.58) for i in range(5)]
+
+    def eye(x):
+        return [(x - 0.1, 0.36), (x - 0.05, 0.33), (x + 0.02, 0.33), (x + 0.08, 0.36), (x + 0.02, 0.38), (x - 0.05, 0.38)]
+
+    circle = np.linspace(0, 2 * np.pi, 13)[:-1]
+    outer = np.stack([0.5 - 0.2 * np.cos(circle), 0.75 + 0.05 * np.sin(circle)], axis=1)
+    circle = np.linspace(0, 2 * np.pi, 9)[:-1]
+    inner = np.stack([0.5 - 0.15 * np.cos(circle), 0.75 + 0.02 * np.sin(circle)], axis=1)
+    unit = np.concatenate([jaw, brows, nose, eye(0.3), eye(0.7), outer, inner])
+    return (unit * [right - left, bottom - top] + [left, top]).astype(int)
+
+
+def bench_cv(repeat, face=None):
+    try:
+        registry = get_registry().warm_up()
+    except Exception as e:
+        print(f"skipping model stages: {type(e).__name__}: {e}", file=sys.stderr)
+        registry = None
+    results = {}
+    for size_name, size in SIZES.items():
+        for faces in FACE_COUNTS:
+            img, boxes = make_fixture(size, faces, face)
+            encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+            prefix = f"{size_name}/{faces}face"
+            results[f"decode/{prefix}"] = timeit(lambda: load_image(encoded), repeat)
+            results[f"decode_reduced2/{prefix}"] = timeit(lambda: load_image(encoded, reduce=2), repeat)
+            results[f"grayscale/{prefix}"] = timeit(lambda: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), repeat)
+            if registry is None:
+                landmarks = [template_landmarks(box) for box in boxes]
+            else:
+                landmarks = registry.landmarker.predict(img, boxes)
+                results[f"detector/{prefix}"] = timeit(lambda: registry.detector.detect(img), repeat)
+                results[f"predictor/{prefix}"] = timeit(
+                    lambda: registry.landmarker.predict(img, boxes), repeat
+                )
+            results[f"features_colour/{prefix}"] = timeit(
+                lambda: [region_statistics(img, points) for points in landmarks], repeat
+            )
+    return results
+
+
+class TemplateDetector:
+    """
+    Stand-in detector returning the fixture's face boxes, scaled to the image it is given.
+    """
+
+    name = "template"
+    min_face = 0
+
+    def __init__(self, size, boxes):
+        width, height = size
+        self.boxes = np.array(boxes, dtype=float) / [width, height, width, height]
+
+    def load(self):
+        return self
+
+    def detect(self, img):
+        height, width = img.shape[:2]
+        boxes = (self.boxes * [width, height, width, height]).astype(int)
+        return boxes, np.ones(len(boxes), dtype=np.float32)
+
+
+class TemplateLandmarker:
+    """
+    Stand-in landmarker fitting template_landmarks to each box.
+    """
+
+    name = "template"
+
+    def load(self):
+        return self
+
+    def predict(self, img, boxes):
+        return np.array([template_landmarks(box) for box in boxes])
+
+
+def bench_batch(repeat, face=None, detect_size=1024):
+    """
+    Time extract_batch on a batch of encoded 1080p photos with 1, 2 and 4
+    threads or worker processes. Without models, the template backends
+    stand in, so only decoding, the colour stage and the pool itself are timed.
+
+    Returns:
+        dict: Timings keyed by stage.
+    """
+    img, boxes = make_fixture(SIZES["1080p"], 1, face)
+    encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+    sources = [encoded] * BATCH_IMAGES
+    try:
+        registry = get_registry().warm_up()
+        prefix = "batch"
+    except Exception:
+        registry = ModelRegistry(TemplateDetector(SIZES["1080p"], boxes), TemplateLandmarker())
+        prefix = "batch_template"
+    results = {}
+    for mode in ("threads", "processes"):
+        for workers in BATCH_WORKERS:
+            results[f"{prefix}/{BATCH_IMAGES}x1080p/{mode}{workers}"] = timeit(
+                lambda: extract_batch(
+                    sources, workers, registry, detect_size, processes=mode == "processes"
+                ),
+                max(repeat // 4, 3),
+            )
+    return results
+
+
+def load_registries(detectors, landmarkers):
+    """
+    Yield a warmed-up ModelRegistry per detector and landmarker pair, skipping unavailable ones.
+    """
+    for detector in detectors:
+        for landmarker in landmarkers:
+            registry = ModelRegistry(detector, landmarker)
+            try:
+                registry.warm_up()
+            except Exception as e:
+                print(f"skipping {registry.name}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            yield registry
+
+
+def read_pts(path):
+    """
+    Read an iBUG .pts annotation file.
+
+    Returns:
+        numpy.ndarray: (68, 2) float array of points.
+    """
+    with open(path) as f:
+        lines = f.read().split("{", 1)[1].split("}", 1)[0].split()
+    return np.array(lines, dtype=float).reshape(-1, 2)
+
+
+def bench_backends(repeat, registries, face=None, labelled=None, detect_size=1024):
+    """
+    Time the full find_faces pipeline per backend pair and, given labelled
+    images, measure how often each pair finds the face and how close its
+    landmarks are to the annotations.
+
+    Returns:
+        tuple: (timings, accuracy) dicts keyed by stage and by backend pair.
+    """
+    annotated = []
+    if labelled:
+        for pts in sorted(glob.glob(os.path.join(labelled, "**", "*.pts"), recursive=True)):
+            for ext in (".jpg", ".png"):
+                if os.path.exists(pts[:-4] + ext):
+                    annotated.append((cv2.imread(pts[:-4] + ext), read_pts(pts)))
+                    break
+
+    timings = {}
+    accuracy = {}
+    for registry in registries:
+        for size_name, size in SIZES.items():
+            img, _ = make_fixture(size, 1, face)
+            timings[f"backend/{registry.name}/{size_name}"] = timeit(
+                lambda: FaceFeatures(img, registry=registry, detect_size=detect_size).find_faces(),
+                repeat,
+            )
+        if not annotated:
+            continue
+        errors = []
+        for img, reference in annotated:
+            faces = FaceFeatures(img, registry=registry, detect_size=detect_size).find_faces()
+            if faces:
+                errors.append(landmark_error(reference, faces[0].landmarks))
+        accuracy[registry.name] = {
+            "images": len(annotated),
+            "detection_rate": len(errors) / len(annotated),
+            "nme_mean": float(np.mean(errors)) if errors else None,
+            "nme_median": float(np.median(errors)) if errors else None,
+        }
+    return timings, accuracy
+
+
+def bench_parsers(repeat):
+    text = "\n".join([PALETTE_TEXT] * 3)
+    engine = HarmonyEngine()
+    return {
+        "local/harmony_palettes": timeit(lambda: engine.palettes(HEXCODES), repeat * 10),
+        "parser/hexcode_from_text": timeit(lambda: hexcode_from_text(text), repeat * 10),
+        "parser/hexcode_remover_from_text": timeit(lambda: hexcode_remover_from_text(text), repeat * 10),
+        "parser/parse_palette_text": timeit(lambda: parse_palette_text(text), repeat * 10),
+    }
+
+
+def bench_llm(repeat, latency):
+    server = MockOpenAIServer(latency=latency).start()
+    handler = ChatHandler(api_key="benchmark", hexcodes=HEXCODES, base_url=server.base_url)
+    results = {
+        "llm/fanout_3": timeit(lambda: handler.get_palettes(), repeat),
+        "llm/combined_1": timeit(lambda: handler.get_palettes(combined=True), repeat),
+        "llm/stream_first_entry": timeit(lambda: next(iter(handler.stream_palettes())), repeat),
+    }
+    server.shutdown()
+
+    # Every fourth request is rate limited; the scheduler retries after Retry-After.
+    server = MockOpenAIServer(latency=latency, rate_limit_every=4, retry_after=latency).start()
+    handler = ChatHandler(
+        api_key="benchmark",
+        hexcodes=HEXCODES,
+        base_url=server.base_url,
+        scheduler=RateLimitScheduler(),
+    )
+    results["llm/fanout_3_rate_limited"] = timeit(lambda: handler.get_palettes(), repeat)
+    server.shutdown()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    List stages whose median regressed by more than tolerance against the baseline.
+
+    A stage only counts once its median is also above the baseline's p90,
+    so run-to-run noise on short stages is not reported. Stages missing
+    from either side are not compared.
+    """
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline.get("results", {}).get(stage)
+        if previous is None:
+            continue
+        limit = max(previous["median_ms"] * (1 + tolerance), previous["p90_ms"])
+        if current["median_ms"] > limit:
+            regressions.append((stage, previous["median_ms"], current["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--face", help="photo of a single face used to build fixtures")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--skip-llm", action="store_true")
+    parser.add_argument("--detectors", nargs="+", choices=tuple(DETECTORS), default=list(DETECTORS))
+    parser.add_argument("--landmarkers", nargs="+", choices=tuple(LANDMARKERS), default=list(LANDMARKERS))
+    parser.add_argument("--labelled", help="directory of images with iBUG .pts landmark annotations")
+    parser.add_argument("--detect-size", type=int, default=1024)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="compare against this results JSON")
+    parser.add_argument("--save-baseline", help="write results JSON as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    face = cv2.imread(args.face) if args.face else None
+    results = {}
+    results.update(bench_cv(args.repeat, face))
+    timings, accuracy = bench_backends(
+        args.repeat,
+        load_registries(args.detectors, args.landmarkers),
+        face,
+        args.labelled,
+        args.detect_size,
+    )
+    results.update(timings)
+    results.update(bench_batch(args.repeat, face, args.detect_size))
+    results.update(bench_parsers(args.repeat))
+    if not args.skip_llm:
+        results.update(bench_llm(args.repeat, args.llm_latency))
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "opencv": cv2.__version__,
+        "fixture": "face" if face is not None else "synthetic",
+        "results": results,
+        "accuracy": accuracy,
+    }
+    for stage, timing in results.items():
+        print(f"{stage:<45} {timing['median_ms']:>10.3f} ms  (p90 {timing['p90_ms']:.3f})")
+    for name, scores in accuracy.items():
+        nme = "n/a" if scores["nme_mean"] is None else f"{scores['nme_mean']:.4f}"
+        print(f"{name:<45} detected {scores['detection_rate']:>6.1%}  NME {nme}")
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    compared = set(results) & set(baseline.get("results", {}))
+    print(f"compared {len(compared)} stages against {args.baseline} ({baseline.get('machine')}, python {baseline.get('python')})")
+    if (baseline.get("machine"), baseline.get("python")) != (report["machine"], report["python"]):
+        print("warning: the baseline was recorded on a different platform", file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance)
+    for stage, before, after in regressions:
+        print(f"REGRESSION {stage}: {before:.3f} ms -> {after:.3f} ms")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
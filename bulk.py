@@ -0,0 +1,329 @@
+"""
+Resumable bulk face analysis of a photo archive into sharded JSONL or Parquet.
+
+Usage:
+    python bulk.py photos/ --output out/ --workers 8
+    python bulk.py manifest.txt --output out/ --format parquet --palettes
+
+The input is a directory, walked recursively for images, or a manifest
+file with one image path per line. The list is frozen into
+output/manifest.txt on the first run and split into fixed shards, so a
+rerun with the same output directory skips every shard already written
+and resumes where an interrupted run stopped. Each shard is written to a
+temporary file and renamed once complete.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from chat_llm.chat_handler import ChatHandler
+from chat_llm.dispatcher import get_loop_thread
+from chat_llm.palette_cache import PaletteCache
+from chat_llm.palettes import PALETTE_KINDS
+from chat_llm.scheduler import BATCH, RateLimitScheduler
+from faceRecModule.faceFeature import FaceFeatures
+from faceRecModule.models import get_registry
+from faceRecModule.quality import QualityError, check_quality
+from faceRecModule.regions import FEATURE_NAMES, bgr_to_hex
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+FORMATS = ("jsonl", "parquet")
+
+# Set in each worker by _init_worker.
+_detect_size = None
+_reduce = 1
+_gate = False
+
+
+def list_images(source):
+    """
+    Image paths under a directory, or the paths listed in a manifest file.
+
+    Returns:
+        list: Paths in a stable order.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(
+                os.path.join(root, name)
+                for name in sorted(files)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        return paths
+    with open(source) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_checkpoint(output, shard_size, fmt):
+    """
+    Return the shard size and format of a run, recording them on the first run.
+
+    Shard boundaries must not move between runs, so a resumed run keeps
+    the settings it started with.
+    """
+    path = os.path.join(output, "checkpoint.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        return checkpoint["shard_size"], checkpoint["format"]
+    with open(path + ".tmp", "w") as f:
+        json.dump({"shard_size": shard_size, "format": fmt}, f)
+    os.replace(path + ".tmp", path)
+    return shard_size, fmt
+
+
+def load_manifest(source, output):
+    """
+    Return the frozen image list of a run, creating it on the first run.
+    """
+    path = os.path.join(output, "manifest.txt")
+    if not os.path.exists(path):
+        paths = list_images(source)
+        with open(path + ".tmp", "w") as f:
+            f.writelines(p + "\n" for p in paths)
+        os.replace(path + ".tmp", path)
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def _init_worker(detect_size, reduce, gate):
+    global _detect_size, _reduce, _gate
+    _detect_size, _reduce, _gate = detect_size, reduce, gate
+    get_registry().warm_up()
+
+
+def analyse(path):
+    """
+    Analyse one image in a worker.
+
+    Returns:
+        dict: One output row; failures are recorded in its error field.
+    """
+    start = time.perf_counter()
+    row = {"path": path, "error": None}
+    detections = None
+    try:
+        if _gate:
+            report = check_quality(path)
+            if not report.ok:
+                raise QualityError(report)
+            detections = report.detections
+        faceFeature = FaceFeatures(path, detect_size=_detect_size, reduce=_reduce)
+        if faceFeature.img is None:
+            raise ValueError("could not decode image")
+        points = faceFeature.find_face_features(detections)
+        hexcodes = bgr_to_hex(faceFeature.get_features_bgr(points))
+        row.update(zip(FEATURE_NAMES, hexcodes))
+        row["landmarks"] = points.astype(int).ravel().tolist()
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        row.update(dict.fromkeys(FEATURE_NAMES))
+        row["landmarks"] = None
+    row["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return row
+
+
+class PaletteStage:
+    """
+    Adds good, bad and blush palettes to analysed rows at batch priority.
+
+    Requests run on the shared dispatcher loop under one RateLimitScheduler,
+    so a whole shard is requested concurrently without exceeding the quota.
+    """
+
+    def __init__(self, api_key, base_url=None, requests_per_minute=3500, tokens_per_minute=90_000, timeout=120.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cache = PaletteCache(path=".cache/palettes.sqlite")
+        self.scheduler = RateLimitScheduler(requests_per_minute, tokens_per_minute)
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    async def _palettes(self, row):
+        handler = ChatHandler(
+            api_key=self.api_key,
+            hexcodes=tuple(row[name] for name in FEATURE_NAMES),
+            cache=self.cache,
+            base_url=self.base_url,
+            client=self.client,
+            scheduler=self.scheduler,
+            priority=BATCH,
+        )
+        for result in await handler.get_palettes_async(self.timeout):
+            row[f"{result.kind}_palette"] = result.content
+            row[f"{result.kind}_error"] = result.error
+
+    async def _shard(self, rows):
+        await asyncio.gather(*(self._palettes(row) for row in rows if row["error"] is None))
+        return rows
+
+    def submit(self, rows):
+        """
+        Start the palette requests for a shard.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the rows, updated in place.
+        """
+        return get_loop_thread().submit(self._shard(rows))
+
+
+def write_jsonl(rows, path, palettes):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def write_parquet(rows, path, palettes):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Fixed schema, so shards where every image failed still match the others.
+    fields = [("path", pa.string()), ("error", pa.string())]
+    fields += [(name, pa.string()) for name in FEATURE_NAMES]
+    fields += [("landmarks", pa.list_(pa.int32())), ("elapsed_ms", pa.float64())]
+    if palettes:
+        for kind in PALETTE_KINDS:
+            fields += [(f"{kind}_palette", pa.string()), (f"{kind}_error", pa.string())]
+    pq.write_table(pa.Table.from_pylist(rows, schema=pa.schema(fields)), path)
+
+
+WRITERS = {"jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def shard_path(output, index, fmt):
+    return os.path.join(output, f"part-{index:05d}.{fmt}")
+
+
+def write_shard(rows, output, index, fmt, palettes=False):
+    """
+    Write one shard atomically, so a partial file is never taken as done.
+    """
+    path = shard_path(output, index, fmt)
+    tmp = path + ".tmp"
+    WRITERS[fmt](rows, tmp, palettes)
+    os.replace(tmp, path)
+
+
+class Progress:
+    """
+    Prints images per second to stderr at most every interval seconds.
+    """
+
+    def __init__(self, total, done, interval=5.0):
+        self.total = total
+        self.done = done
+        self.processed = 0
+        self.errors = 0
+        self.interval = interval
+        self.start = self._last = time.perf_counter()
+
+    def update(self, row):
+        self.processed += 1
+        self.errors += row["error"] is not None
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.processed / elapsed if elapsed else 0.0
+        print(
+            f"{self.done + self.processed}/{self.total} images, "
+            f"{rate:.1f} images/s, {self.errors} errors",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def run(args):
+    os.makedirs(args.output, exist_ok=True)
+    paths = load_manifest(args.source, args.output)
+    shard_size, fmt = load_checkpoint(args.output, args.shard_size, args.format)
+    shards = [
+        (index, paths[start:start + shard_size])
+        for index, start in enumerate(range(0, len(paths), shard_size))
+    ]
+    pending = [
+        (index, shard) for index, shard in shards
+        if not os.path.exists(shard_path(args.output, index, fmt))
+    ]
+    done = len(paths) - sum(len(shard) for _, shard in pending)
+    if done:
+        print(f"resuming: {len(shards) - len(pending)} of {len(shards)} shards already written", file=sys.stderr)
+
+    if multiprocessing.get_start_method() == "fork":
+        # Loaded before the pool forks, so the workers share the model pages copy-on-write.
+        get_registry().warm_up()
+        gc.freeze()
+
+    palettes = None
+    if args.palettes:
+        palettes = PaletteStage(
+            os.getenv("OPENAI_API_KEY"), args.base_url, args.rpm, args.tpm, args.llm_timeout
+        )
+
+    progress = Progress(len(paths), done)
+    with multiprocessing.Pool(
+        args.workers, initializer=_init_worker, initargs=(args.detect_size, args.reduce, args.quality_gate)
+    ) as pool:
+        # Palettes of one shard are requested while the next shard is analysed.
+        previous = None
+        for index, shard in pending:
+            rows = []
+            for row in pool.imap(analyse, shard, chunksize=args.chunksize):
+                rows.append(row)
+                progress.update(row)
+            if previous is not None:
+                write_shard(previous[1].result(), args.output, previous[0], fmt, True)
+            if palettes is None:
+                write_shard(rows, args.output, index, fmt)
+            else:
+                previous = (index, palettes.submit(rows))
+        if previous is not None:
+            write_shard(previous[1].result(), args.output, previous[0], fmt, True)
+    progress.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="image directory or manifest file")
+    parser.add_argument("--output", required=True, help="directory for shards and checkpoint")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument("--chunksize", type=int, default=8)
+    parser.add_argument("--detect-size", type=int, default=1024)
+    parser.add_argument("--reduce", type=int, choices=(1, 2, 4, 8), default=1)
+    parser.add_argument("--quality-gate", action="store_true", help="skip blurred, badly lit or faceless images")
+    parser.add_argument("--palettes", action="store_true", help="also generate palettes")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint")
+    parser.add_argument("--rpm", type=float, default=3500, help="palette requests per minute")
+    parser.add_argument("--tpm", type=float, default=90_000, help="palette tokens per minute")
+    parser.add_argument("--llm-timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires pyarrow")
+    if args.palettes:
+        load_dotenv(".env")
+        if not os.getenv("OPENAI_API_KEY"):
+            parser.error("--palettes requires OPENAI_API_KEY")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
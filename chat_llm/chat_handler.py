@@ -1,9 +1,61 @@
+import asyncio
+import queue
 import re
+import threading
+import time
+from typing import NamedTuple, Optional
+
 from openai import OpenAI
 
+from chat_llm.dispatcher import STREAM_USAGE, chunk_usage, get_async_client, get_loop_thread
+from chat_llm.palettes import (
+    PALETTE_KINDS,
+    PALETTE_SIZE,
+    PALETTES_RESPONSE_FORMAT,
+    PaletteLineBuffer,
+    format_palette,
+    parse_palette_text,
+    parse_palettes_json,
+)
+from chat_llm.harmony import get_engine
+from chat_llm.scheduler import INTERACTIVE, estimate_tokens
+from metrics import get_metrics, log_event
+
+MODEL = "gpt-3.5-turbo"
+# Structured outputs need a model that supports json_schema response formats.
+COMBINED_MODEL = "gpt-4o-mini"
+TEXT_FORMAT = {"type": "text"}
+
+
+class PaletteResult(NamedTuple):
+    """
+    Outcome of one palette request.
+    """
+
+    kind: str
+    content: Optional[str]
+    error: Optional[str]
+    elapsed: float
+    entries: Optional[list] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
 
 class ChatHandler:
-    def __init__(self, api_key: str, hexcodes: tuple):
+    def __init__(
+        self,
+        api_key: str,
+        hexcodes: tuple,
+        cache=None,
+        base_url=None,
+        client=None,
+        scheduler=None,
+        priority=INTERACTIVE,
+        harmony=None,
+        seed=False,
+    ):
         """
         Initializes the ChatHandler with OpenAI API key and facial feature hexcodes.
 
@@ -11,48 +63,539 @@ class ChatHandler:
             api_key (str): OpenAI API key.
             hexcodes (tuple): A tuple containing hexcodes for facial features in the order:
                 (left_eye_colour, right_eye_colour, nose_colour, jaw_colour, lips_colour).
+            cache (PaletteCache, optional): Response cache shared across handlers.
+            base_url (str, optional): OpenAI-compatible endpoint, e.g. a local mock server.
+            client (OpenAI, optional): Shared sync client; one is created if not given.
+            scheduler (RateLimitScheduler, optional): Shared limiter and retry
+                scheduler; sync calls are then routed through the dispatcher loop.
+            priority (int): Scheduler priority, INTERACTIVE or BATCH.
+            harmony (HarmonyEngine, optional): Local palette engine whose
+                palettes replace any completion that fails or times out.
+            seed (bool): Give the model the local palette colours and ask it
+                only for the rationales.
         """
-        self.client = OpenAI(api_key=api_key)
+        self.client = client or OpenAI(api_key=api_key, base_url=base_url)
+        self.scheduler = scheduler
+        self.priority = priority
+        self.harmony = harmony
+        self.seed = seed
+        self._local_palettes = None
+        self.async_client = get_async_client(
+            api_key, base_url, max_retries=2 if scheduler is None else 0
+        )
+        self.cache = cache
+        self.hexcodes = tuple(hexcodes)
         self.left_eye_colour = hexcodes[0]
         self.right_eye_colour = hexcodes[1]
         self.nose_colour = hexcodes[2]
         self.jaw_colour = hexcodes[3]
         self.lips_colour = hexcodes[4]
+        self.usage = {}
+        self._usage_lock = threading.Lock()
+
+    def _record_usage(self, mode: str, usage, model=MODEL, seconds=None, error=None):
+        """
+        Adds one completion's token usage to the totals for mode and exports it as metrics.
+        """
+        metrics = get_metrics()
+        status = "ok" if error is None else "error"
+        metrics.inc("llm_requests_total", mode=mode, model=model, status=status)
+        if seconds is not None:
+            metrics.observe("llm_request_seconds", seconds, mode=mode, model=model)
+        if usage is not None:
+            metrics.inc("llm_tokens_total", usage.prompt_tokens, mode=mode, model=model, type="prompt")
+            metrics.inc("llm_tokens_total", usage.completion_tokens, mode=mode, model=model, type="completion")
+        log_event(
+            "llm_request",
+            mode=mode,
+            model=model,
+            seconds=seconds,
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            error=error,
+        )
+        if error is not None:
+            return
+        with self._usage_lock:
+            totals = self.usage.setdefault(
+                mode, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            )
+            totals["calls"] += 1
+            if usage is not None:
+                totals["prompt_tokens"] += usage.prompt_tokens
+                totals["completion_tokens"] += usage.completion_tokens
+                totals["total_tokens"] += usage.total_tokens
+
+    def usage_report(self):
+        """
+        Token usage per mode ("separate" or "combined") for the calls made by this handler.
+
+        Returns:
+            dict: Maps each mode to its call count and token totals.
+        """
+        with self._usage_lock:
+            return {mode: dict(totals) for mode, totals in self.usage.items()}
+
+    def _create(self, mode: str, messages: list, model=MODEL, response_format=TEXT_FORMAT):
+        """
+        Sends one completion on the sync client and records its usage.
+        """
+        if self.scheduler is not None:
+            return get_loop_thread().run(
+                self._create_async(mode, messages, model, response_format)
+            )
+        start = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                response_format=response_format,
+                messages=messages,
+            )
+        except Exception as e:
+            self._record_usage(mode, None, model, time.perf_counter() - start, type(e).__name__)
+            raise
+        self._record_usage(mode, response.usage, model, time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    async def _send(self, messages: list, deadline=None, **kwargs):
+        """
+        Calls chat.completions.create on the async client, through the scheduler when one is set.
+
+        Parameters:
+            messages (list): Chat messages to send.
+            deadline (float, optional): time.monotonic() value after which no retry starts.
+            **kwargs: Other create() arguments.
+        """
+        async def call():
+            return await self.async_client.chat.completions.create(messages=messages, **kwargs)
+
+        if self.scheduler is None:
+            return await call()
+        return await self.scheduler.run(call, estimate_tokens(messages), self.priority, deadline)
+
+    async def _create_async(
+        self, mode: str, messages: list, model=MODEL, response_format=TEXT_FORMAT, deadline=None
+    ):
+        """
+        Sends one completion on the async client and records its usage.
+        """
+        start = time.perf_counter()
+        try:
+            response = await self._send(
+                messages, deadline, model=model, response_format=response_format
+            )
+        except Exception as e:
+            self._record_usage(mode, None, model, time.perf_counter() - start, type(e).__name__)
+            raise
+        self._record_usage(mode, response.usage, model, time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    def local_palettes(self):
+        """
+        Palettes from the local harmony engine, computed once per handler.
+
+        Returns:
+            dict: Maps each kind in PALETTE_KINDS to a list of PaletteEntry.
+        """
+        if self._local_palettes is None:
+            self._local_palettes = (self.harmony or get_engine()).palettes(self.hexcodes)
+        return self._local_palettes
+
+    def _cache_kind(self, kind: str):
+        """
+        Seeded answers are cached apart from free ones.
+        """
+        return f"{kind}-seeded" if self.seed else kind
+
+    def _seed_message(self, kinds):
+        """
+        User message fixing the colours of the given palettes, so only the rationales are generated.
+        """
+        palettes = self.local_palettes()
+        lines = [
+            f"{kind}: " + ", ".join(f"{entry.hex} ({entry.name})" for entry in palettes[kind])
+            for kind in kinds
+        ]
+        return {
+            "role": "user",
+            "content": "Use exactly these colours, in this order, keeping their hexcodes and names, and only write the rationale for each:\n"
+            + "\n".join(lines),
+        }
+
+    def _fallback(self, kind: str, error: str):
+        """
+        Local palette entries standing in for a failed completion.
+        """
+        get_metrics().inc("palette_fallback_total", kind=kind)
+        log_event("palette_fallback", kind=kind, error=error)
+        return self.local_palettes()[kind]
+
+    def good_palette_messages(self):
+        """
+        Messages asking for colours that suit the user.
+        """
+        return [
+            {
+                "role": "system",
+                "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics . you have to answer in the format of the given example",
+            },
+            {
+                "role": "user",
+                "content": f"My facial features hexcodes are left eye colour =={self.left_eye_colour}, right eye colour =={self.right_eye_colour}, nose colour =={self.nose_colour}, jaw colour =={self.jaw_colour}, and lips colour =={self.lips_colour}.",
+            },
+            {
+                "role": "user",
+                "content": """I want to know which 5 colours will look good on me and why? be creative and answer in the given format,  example: 
+                1. #f4e1cb (peach): Peach complements your warm facial features and will give you a fresh and radiant look. It will be perfect for summers with its soft and delicate hue.
+                2. #4b86b4 (steel blue): Steel blue will enhance the cool tones in your eyes and create a striking contrast with your warm facial features. This color is versatile and can be worn in both casual and formal settings.
+                3. #f9c1bb (coral pink): Coral pink will bring out the rosy tones in your lips and cheeks. This vibrant color will add a pop of energy to your look and is ideal for a fun and playful vibe.
+                4. #82647a (mauve): Mauve will complement the subtle tones in your nose and jaw area. This elegant and understated color is perfect for a sophisticated and chic look, ideal for evenings out or special occasions.
+                5. #ffd966 (mustard yellow): Mustard yellow will enhance the warmth in your facial features and add a touch of sunshine to your overall appearance. This bold and unconventional color choice will make you stand out and exude confidence and individuality.
+                """,
+            },
+        ]
+
+    def bad_palette_messages(self):
+        """
+        Messages asking for colours that do not suit the user.
+        """
+        return [
+            {
+                "role": "system",
+                "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics. you have to answer in the format of the given example",
+            },
+            {
+                "role": "user",
+                "content": f"My facial features hexcodes are left eye colour =={self.left_eye_colour}, right eye colour =={self.right_eye_colour}, nose colour =={self.nose_colour}, jaw colour =={self.jaw_colour}, and lips colour =={self.lips_colour}.",
+            },
+            {
+                "role": "user",
+                "content": """I want to know which 5 colours will NOT complement me and why? be creative but never be rude and answer in the given format,  example:
+                1. #687864 (Sage Green) - This cool-toned green might clash with the warm tones of your eye, nose, and lip colors, creating a dissonance in your overall look.
+                2. #874c62 (Mauve) - The muted pink undertones of mauve might make your lip color appear dull in comparison, not accentuating your natural features.
+                3. #433d4f (Charcoal Gray) - The deep gray might overpower the softness of your jaw and nose colors, creating a mismatched look that doesn't enhance your natural beauty.
+                4. #b28975 (Mocha) - The brown undertones of mocha might blend in too much with your jaw color, making your features appear flat and lacking dimension.
+                5. #91a8d0 (Periwinkle Blue) - The cool-toned blue might not harmonize well with the warm hues of your eyes and lips, potentially washing out your complexion and not bringing out your best features. 
+                """,
+            },
+        ]
+
+    def blush_messages(self):
+        """
+        Messages asking for blush colours based on the lip colour.
+        """
+        return [
+            {
+                "role": "system",
+                "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics. you have to answer in the format of the given example",
+            },
+            {
+                "role": "user",
+                "content": f"My facial features hexcodes of lips is {self.lips_colour}.",
+            },
+            {
+                "role": "user",
+                "content": """I want to know which 5 colours will look good on me and why be creative and answer in the given format,  example:
+                1. #FFFFFF (White): White will provide a striking contrast to your lip color, making it pop even more. It represents purity and simplicity and will give you a fresh and clean look.
+                2. #2a9d8f (Teal): Teal is a cool and calming color that will complement the warmth of your lip color. It represents tranquility and balance and will give your overall look a modern and sophisticated edge.
+                3. #f9c22e (Mustard Yellow): Mustard yellow will add a vibrant touch to your look. It represents energy and positivity and will bring a fun and playful element to your outfit.
+                4. #6b5b95 (Lavender): Lavender is a soft and romantic color that will enhance the femininity of your lip color. It represents grace and elegance and will give your look a dreamy and whimsical vibe.
+                5. #e07a5f (Terracotta): Terracotta is an earthy and warm color that will harmonize beautifully with your lip color. It represents strength and stability and will give your outfit a grounded and natural feel.
+                """,
+            },
+        ]
+
+    def _complete(self, kind: str, messages: list, hexcodes: tuple):
+        """
+        Runs one completion, going through the response cache when one is set.
+
+        Parameters:
+            kind (str): Palette kind used to separate cache entries.
+            messages (list): Chat messages to send.
+            hexcodes (tuple): Hexcodes the answer depends on.
+
+        Returns:
+            str: The completion text.
+        """
+        def request():
+            return self._create("separate", messages)
+
+        try:
+            if self.cache is None:
+                return request()
+            return self.cache.get_or_compute(self._cache_kind(kind), hexcodes, request)
+        except Exception as e:
+            if self.harmony is None:
+                raise
+            return format_palette(self._fallback(kind, f"{type(e).__name__}: {e}"))
 
-    def get_good_palette(self,**kwargs):
+    def _palette_requests(self):
+        """
+        Messages and cache hexcodes for each palette kind, in PALETTE_KINDS order.
+        """
+        requests = [
+            ("good", self.good_palette_messages(), self.hexcodes),
+            ("bad", self.bad_palette_messages(), self.hexcodes),
+            ("blush", self.blush_messages(), (self.lips_colour,)),
+        ]
+        if self.seed:
+            # Seeded colours depend on every feature, not just the lips.
+            requests = [
+                (kind, messages + [self._seed_message([kind])], self.hexcodes)
+                for kind, messages, _ in requests
+            ]
+        return requests
+
+    async def _complete_async(self, kind: str, messages: list, hexcodes: tuple, timeout: float):
+        """
+        Runs one completion on the async client with a deadline.
+
+        Returns:
+            PaletteResult: The completion text, or the error that prevented it.
+        """
+        deadline = time.monotonic() + timeout
+
+        async def request():
+            return await self._create_async("separate", messages, deadline=deadline)
+
+        start = time.perf_counter()
+        try:
+            if self.cache is None:
+                content = await asyncio.wait_for(request(), timeout)
+            else:
+                content = await asyncio.wait_for(
+                    self.cache.aget_or_compute(self._cache_kind(kind), hexcodes, request), timeout
+                )
+            return PaletteResult(kind, content, None, time.perf_counter() - start)
+        except asyncio.TimeoutError:
+            error = f"timed out after {timeout}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if self.harmony is not None:
+            entries = self._fallback(kind, error)
+            return PaletteResult(
+                kind, format_palette(entries), None, time.perf_counter() - start, entries
+            )
+        return PaletteResult(kind, None, error, time.perf_counter() - start)
+
+    async def get_palettes_async(self, timeout: float = 60.0):
+        """
+        Requests the good, bad and blush palettes concurrently.
+
+        Parameters:
+            timeout (float): Per-call deadline in seconds.
+
+        Returns:
+            list: One PaletteResult per kind, in PALETTE_KINDS order.
+        """
+        return await asyncio.gather(
+            *(
+                self._complete_async(kind, messages, hexcodes, timeout)
+                for kind, messages, hexcodes in self._palette_requests()
+            )
+        )
+
+    def combined_messages(self):
+        """
+        Messages asking for all three palettes in one structured answer.
+        """
+        return [
+            {
+                "role": "system",
+                "content": "You are a fashion assistant and a cosmetic advisor. Answer with JSON matching the given schema.",
+            },
+            {
+                "role": "user",
+                "content": f"My facial features hexcodes are left eye colour =={self.left_eye_colour}, right eye colour =={self.right_eye_colour}, nose colour =={self.nose_colour}, jaw colour =={self.jaw_colour}, and lips colour =={self.lips_colour}.",
+            },
+            {
+                "role": "user",
+                "content": f"""Give exactly {PALETTE_SIZE} colours for each list, each with a #rrggbb hex, a short colour name and a creative one or two sentence rationale:
+                good: colours that will look good on me.
+                bad: colours that will NOT complement me; never be rude.
+                blush: blush colours that suit my lip colour.""",
+            },
+        ] + ([self._seed_message(PALETTE_KINDS)] if self.seed else [])
+
+    async def get_palettes_combined_async(self, timeout: float = 60.0):
+        """
+        Requests all three palettes in a single structured completion.
+
+        The JSON answer is validated into PaletteEntry lists before it is
+        cached. If the call fails, times out or returns an invalid answer,
+        the three separate completions are used instead, within whatever
+        is left of the same deadline.
+
+        Parameters:
+            timeout (float): Deadline in seconds for the whole call, fallback included.
+
+        Returns:
+            list: One PaletteResult per kind, in PALETTE_KINDS order.
+        """
+        deadline = time.monotonic() + timeout
+
+        async def request():
+            text = await self._create_async(
+                "combined",
+                self.combined_messages(),
+                model=COMBINED_MODEL,
+                response_format=PALETTES_RESPONSE_FORMAT,
+                deadline=deadline,
+            )
+            parse_palettes_json(text)
+            return text
+
+        start = time.perf_counter()
+        try:
+            if self.cache is None:
+                text = await asyncio.wait_for(request(), timeout)
+            else:
+                text = await asyncio.wait_for(
+                    self.cache.aget_or_compute(self._cache_kind("combined"), self.hexcodes, request), timeout
+                )
+            palettes = parse_palettes_json(text)
+        except Exception:
+            return await self.get_palettes_async(max(deadline - time.monotonic(), 0.0))
+
+        elapsed = time.perf_counter() - start
+        return [
+            PaletteResult(kind, format_palette(palettes[kind]), None, elapsed, palettes[kind])
+            for kind in PALETTE_KINDS
+        ]
+
+    def get_palettes(self, timeout: float = 60.0, combined: bool = False):
+        """
+        Blocking wrapper running the palette requests on the shared dispatcher loop.
+
+        Parameters:
+            timeout (float): Per-call deadline in seconds.
+            combined (bool): Ask for all palettes in one structured completion,
+                falling back to three separate ones on failure.
+
+        Returns:
+            list: One PaletteResult per kind, in PALETTE_KINDS order.
+        """
+        if combined:
+            return get_loop_thread().run(self.get_palettes_combined_async(timeout))
+        return get_loop_thread().run(self.get_palettes_async(timeout))
+
+    async def _store_stream(self, kind: str, hexcodes: tuple, text: str):
+        """
+        Caches a streamed answer only if it parses into a full palette, so a
+        malformed answer is asked for again instead of being served from the cache.
+        """
+        if self.cache is None:
+            return
+        entries = len(parse_palette_text(text))
+        if entries != PALETTE_SIZE:
+            log_event("palette_invalid", kind=kind, entries=entries)
+            return
+        await self.cache.astore(self._cache_kind(kind), hexcodes, text)
+
+    async def _stream_palette_async(self, kind: str, messages: list, hexcodes: tuple, emit, deadline=None):
+        """
+        Streams one palette on the async client, calling emit with each entry as it completes.
+        """
+        buffer = PaletteLineBuffer()
+        cached = await self.cache.alookup(self._cache_kind(kind), hexcodes) if self.cache is not None else None
+        if cached is not None:
+            for entry in buffer.feed(cached) + buffer.close():
+                emit(entry)
+            return
+
+        usage = None
+        start = time.perf_counter()
+        stream = await self._send(
+            messages,
+            deadline,
+            model=MODEL,
+            response_format=TEXT_FORMAT,
+            stream=True,
+            extra_body=STREAM_USAGE,
+        )
+        try:
+            async for chunk in stream:
+                usage = chunk_usage(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    for entry in buffer.feed(chunk.choices[0].delta.content):
+                        emit(entry)
+        finally:
+            # Frees the connection, and the scheduler slot, also on timeout or cancellation.
+            await stream.close()
+        for entry in buffer.close():
+            emit(entry)
+        self._record_usage("stream", usage, MODEL, time.perf_counter() - start)
+        await self._store_stream(kind, hexcodes, buffer.text)
+
+    def stream_palettes(self, timeout: float = 60.0, kinds=PALETTE_KINDS):
+        """
+        Streams the palettes concurrently, interleaving their entries as they arrive.
+
+        Parameters:
+            timeout (float): Per-palette deadline in seconds.
+            kinds (tuple): Palette kinds to stream, all three by default.
+
+        Yields:
+            tuple: (kind, entry, error) where entry is a PaletteEntry, or
+                error is a message and entry is None if that palette failed.
+                With a harmony engine, a failed palette is instead sent
+                again in full from the local entries, each carrying the
+                error; they replace any entries already yielded for that
+                kind.
+        """
+        sink = queue.Queue()
+
+        async def run(kind, messages, hexcodes):
+            def emit(entry):
+                sink.put((kind, entry, None))
+
+            error = None
+            try:
+                await asyncio.wait_for(
+                    self._stream_palette_async(
+                        kind, messages, hexcodes, emit, time.monotonic() + timeout
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                error = f"timed out after {timeout}s"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                if error is not None:
+                    if self.harmony is None:
+                        sink.put((kind, None, error))
+                    else:
+                        for entry in self._fallback(kind, error):
+                            sink.put((kind, entry, error))
+                sink.put(None)
+
+        requests = [request for request in self._palette_requests() if request[0] in kinds]
+        futures = [get_loop_thread().submit(run(*request)) for request in requests]
+        remaining = len(futures)
+        try:
+            while remaining:
+                item = sink.get()
+                if item is None:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def get_good_palette(self, **kwargs):
         """
         Provides a good color palette based on user's facial features.
 
         Returns:
             dict: A dictionary containing hexcodes and corresponding color names for the palette.
         """
+        content = self._complete("good", self.good_palette_messages(), self.hexcodes)
         q = kwargs.get("queue")
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            response_format={"type": "text"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics . you have to answer in the format of the given example",
-                },
-                {
-                    "role": "user",
-                    "content": f"My facial features hexcodes are left eye colour =={self.left_eye_colour}, right eye colour =={self.right_eye_colour}, nose colour =={self.nose_colour}, jaw colour =={self.jaw_colour}, and lips colour =={self.lips_colour}.",
-                },
-                {
-                    "role": "user",
-                    "content": """I want to know which 5 colours will look good on me and why? be creative and answer in the given format,  example: 
-                    1. #f4e1cb (peach): Peach complements your warm facial features and will give you a fresh and radiant look. It will be perfect for summers with its soft and delicate hue.
-                    2. #4b86b4 (steel blue): Steel blue will enhance the cool tones in your eyes and create a striking contrast with your warm facial features. This color is versatile and can be worn in both casual and formal settings.
-                    3. #f9c1bb (coral pink): Coral pink will bring out the rosy tones in your lips and cheeks. This vibrant color will add a pop of energy to your look and is ideal for a fun and playful vibe.
-                    4. #82647a (mauve): Mauve will complement the subtle tones in your nose and jaw area. This elegant and understated color is perfect for a sophisticated and chic look, ideal for evenings out or special occasions.
-                    5. #ffd966 (mustard yellow): Mustard yellow will enhance the warmth in your facial features and add a touch of sunshine to your overall appearance. This bold and unconventional color choice will make you stand out and exude confidence and individuality.
-                    """,
-                },
-            ],
-        )
-        q.put([response.choices[0].message.content,1])
-        return response.choices[0].message.content
+        if q is not None:
+            q.put([content,1])
+        return content
 
     def get_bad_palette(self, **kwargs):
         """
@@ -61,33 +604,11 @@ class ChatHandler:
         Returns:
             dict: A dictionary containing hexcodes and corresponding color names for the palette.
         """
+        content = self._complete("bad", self.bad_palette_messages(), self.hexcodes)
         q = kwargs.get("queue")
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            response_format={"type": "text"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics. you have to answer in the format of the given example",
-                },
-                {
-                    "role": "user",
-                    "content": f"My facial features hexcodes are left eye colour =={self.left_eye_colour}, right eye colour =={self.right_eye_colour}, nose colour =={self.nose_colour}, jaw colour =={self.jaw_colour}, and lips colour =={self.lips_colour}.",
-                },
-                {
-                    "role": "user",
-                    "content": """I want to know which 5 colours will NOT complement me and why? be creative but never be rude and answer in the given format,  example:
-                    1. #687864 (Sage Green) - This cool-toned green might clash with the warm tones of your eye, nose, and lip colors, creating a dissonance in your overall look.
-                    2. #874c62 (Mauve) - The muted pink undertones of mauve might make your lip color appear dull in comparison, not accentuating your natural features.
-                    3. #433d4f (Charcoal Gray) - The deep gray might overpower the softness of your jaw and nose colors, creating a mismatched look that doesn't enhance your natural beauty.
-                    4. #b28975 (Mocha) - The brown undertones of mocha might blend in too much with your jaw color, making your features appear flat and lacking dimension.
-                    5. #91a8d0 (Periwinkle Blue) - The cool-toned blue might not harmonize well with the warm hues of your eyes and lips, potentially washing out your complexion and not bringing out your best features. 
-                    """,
-                },
-            ],
-        )
-        q.put([response.choices[0].message.content,2])
-        return response.choices[0].message.content
+        if q is not None:
+            q.put([content,2])
+        return content
 
     def get_blush(self, **kwargs):
         """
@@ -96,33 +617,11 @@ class ChatHandler:
         Returns:
             str: A string containing detailed information about the suitable blush colors.
         """
+        content = self._complete("blush", self.blush_messages(), (self.lips_colour,))
         q = kwargs.get("queue")
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            response_format={"type": "text"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a fashion assistant and a cosmetic advisor. Answer the user's questions about fashion and cosmetics. you have to answer in the format of the given example",
-                },
-                {
-                    "role": "user",
-                    "content": f"My facial features hexcodes of lips is {self.lips_colour}.",
-                },
-                {
-                    "role": "user",
-                    "content": """I want to know which 5 colours will look good on me and why be creative and answer in the given format,  example:
-                    1. #FFFFFF (White): White will provide a striking contrast to your lip color, making it pop even more. It represents purity and simplicity and will give you a fresh and clean look.
-                    2. #2a9d8f (Teal): Teal is a cool and calming color that will complement the warmth of your lip color. It represents tranquility and balance and will give your overall look a modern and sophisticated edge.
-                    3. #f9c22e (Mustard Yellow): Mustard yellow will add a vibrant touch to your look. It represents energy and positivity and will bring a fun and playful element to your outfit.
-                    4. #6b5b95 (Lavender): Lavender is a soft and romantic color that will enhance the femininity of your lip color. It represents grace and elegance and will give your look a dreamy and whimsical vibe.
-                    5. #e07a5f (Terracotta): Terracotta is an earthy and warm color that will harmonize beautifully with your lip color. It represents strength and stability and will give your outfit a grounded and natural feel.
-                    """,
-                },
-            ],
-        )
-        q.put([response.choices[0].message.content,3])
-        return response.choices[0].message.content
+        if q is not None:
+            q.put([content,3])
+        return content
 
 
 def hexcode_from_text(text):
@@ -159,30 +658,15 @@ if __name__ == "__main__":
 
     from dotenv import load_dotenv
     import os
-    import time
-    load_dotenv("../setup/.env")
+    # Run from the repository root: python -m chat_llm.chat_handler
+    load_dotenv("setup/.env")
     chat_handler = ChatHandler(
         api_key=os.getenv("OPENAI_API_KEY"),
         hexcodes=("#dfb8aa", "#c39e8e", "#d09d82", "#e4c1ad", "#c34a5b"),
     )
-    import multiprocessing as mp
-    q = mp.Queue()
-    p1 = mp.Process(target=chat_handler.get_good_palette,kwargs={"queue":q})
-    p2 = mp.Process(target=chat_handler.get_bad_palette,kwargs={"queue":q})
-    p3 = mp.Process(target=chat_handler.get_blush,kwargs={"queue":q})
-    initial_time = time.time()
-    p1.start()  
-    p2.start()
-    p3.start()
-
-    p1.join()
-    p2.join()
-    p3.join()
-
-    final_time = time.time()
-    print("Done")
-    print(q.get())
-    print(q.get())
-    print(q.get())
-    print(final_time-initial_time)
-
+    for combined in (False, True):
+        initial_time = time.time()
+        for result in chat_handler.get_palettes(combined=combined):
+            print(result.kind, result.error or result.content)
+        print(time.time()-initial_time)
+    print(chat_handler.usage_report())
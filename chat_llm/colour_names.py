@@ -0,0 +1,228 @@
+"""
+Named colours used to label generated palettes.
+
+The CSS/X11 colour keywords, plus common fashion and cosmetics colour
+names so skin-adjacent and muted tones get natural labels.
+"""
+
+CSS_COLOURS = (
+    ("alice blue", "#f0f8ff"),
+    ("antique white", "#faebd7"),
+    ("aqua", "#00ffff"),
+    ("aquamarine", "#7fffd4"),
+    ("azure", "#f0ffff"),
+    ("beige", "#f5f5dc"),
+    ("bisque", "#ffe4c4"),
+    ("black", "#000000"),
+    ("blanched almond", "#ffebcd"),
+    ("blue", "#0000ff"),
+    ("blue violet", "#8a2be2"),
+    ("brown", "#a52a2a"),
+    ("burlywood", "#deb887"),
+    ("cadet blue", "#5f9ea0"),
+    ("chartreuse", "#7fff00"),
+    ("chocolate", "#d2691e"),
+    ("coral", "#ff7f50"),
+    ("cornflower blue", "#6495ed"),
+    ("cornsilk", "#fff8dc"),
+    ("crimson", "#dc143c"),
+    ("dark blue", "#00008b"),
+    ("dark cyan", "#008b8b"),
+    ("dark goldenrod", "#b8860b"),
+    ("dark grey", "#a9a9a9"),
+    ("dark green", "#006400"),
+    ("dark khaki", "#bdb76b"),
+    ("dark magenta", "#8b008b"),
+    ("dark olive green", "#556b2f"),
+    ("dark orange", "#ff8c00"),
+    ("dark orchid", "#9932cc"),
+    ("dark red", "#8b0000"),
+    ("dark salmon", "#e9967a"),
+    ("dark sea green", "#8fbc8f"),
+    ("dark slate blue", "#483d8b"),
+    ("dark slate grey", "#2f4f4f"),
+    ("dark turquoise", "#00ced1"),
+    ("dark violet", "#9400d3"),
+    ("deep pink", "#ff1493"),
+    ("deep sky blue", "#00bfff"),
+    ("dim grey", "#696969"),
+    ("dodger blue", "#1e90ff"),
+    ("firebrick", "#b22222"),
+    ("floral white", "#fffaf0"),
+    ("forest green", "#228b22"),
+    ("fuchsia", "#ff00ff"),
+    ("gainsboro", "#dcdcdc"),
+    ("ghost white", "#f8f8ff"),
+    ("gold", "#ffd700"),
+    ("goldenrod", "#daa520"),
+    ("grey", "#808080"),
+    ("green", "#008000"),
+    ("green yellow", "#adff2f"),
+    ("honeydew", "#f0fff0"),
+    ("hot pink", "#ff69b4"),
+    ("indian red", "#cd5c5c"),
+    ("indigo", "#4b0082"),
+    ("ivory", "#fffff0"),
+    ("khaki", "#f0e68c"),
+    ("lavender", "#e6e6fa"),
+    ("lavender blush", "#fff0f5"),
+    ("lawn green", "#7cfc00"),
+    ("lemon chiffon", "#fffacd"),
+    ("light blue", "#add8e6"),
+    ("light coral", "#f08080"),
+    ("light cyan", "#e0ffff"),
+    ("light goldenrod yellow", "#fafad2"),
+    ("light grey", "#d3d3d3"),
+    ("light green", "#90ee90"),
+    ("light pink", "#ffb6c1"),
+    ("light salmon", "#ffa07a"),
+    ("light sea green", "#20b2aa"),
+    ("light sky blue", "#87cefa"),
+    ("light slate grey", "#778899"),
+    ("light steel blue", "#b0c4de"),
+    ("light yellow", "#ffffe0"),
+    ("lime", "#00ff00"),
+    ("lime green", "#32cd32"),
+    ("linen", "#faf0e6"),
+    ("maroon", "#800000"),
+    ("medium aquamarine", "#66cdaa"),
+    ("medium blue", "#0000cd"),
+    ("medium orchid", "#ba55d3"),
+    ("medium purple", "#9370db"),
+    ("medium sea green", "#3cb371"),
+    ("medium slate blue", "#7b68ee"),
+    ("medium spring green", "#00fa9a"),
+    ("medium turquoise", "#48d1cc"),
+    ("medium violet red", "#c71585"),
+    ("midnight blue", "#191970"),
+    ("mint cream", "#f5fffa"),
+    ("misty rose", "#ffe4e1"),
+    ("moccasin", "#ffe4b5"),
+    ("navajo white", "#ffdead"),
+    ("navy", "#000080"),
+    ("old lace", "#fdf5e6"),
+    ("olive", "#808000"),
+    ("olive drab", "#6b8e23"),
+    ("orange", "#ffa500"),
+    ("orange red", "#ff4500"),
+    ("orchid", "#da70d6"),
+    ("pale goldenrod", "#eee8aa"),
+    ("pale green", "#98fb98"),
+    ("pale turquoise", "#afeeee"),
+    ("pale violet red", "#db7093"),
+    ("papaya whip", "#ffefd5"),
+    ("peach puff", "#ffdab9"),
+    ("peru", "#cd853f"),
+    ("pink", "#ffc0cb"),
+    ("plum", "#dda0dd"),
+    ("powder blue", "#b0e0e6"),
+    ("purple", "#800080"),
+    ("rebecca purple", "#663399"),
+    ("red", "#ff0000"),
+    ("rosy brown", "#bc8f8f"),
+    ("royal blue", "#4169e1"),
+    ("saddle brown", "#8b4513"),
+    ("salmon", "#fa8072"),
+    ("sandy brown", "#f4a460"),
+    ("sea green", "#2e8b57"),
+    ("seashell", "#fff5ee"),
+    ("sienna", "#a0522d"),
+    ("silver", "#c0c0c0"),
+    ("sky blue", "#87ceeb"),
+    ("slate blue", "#6a5acd"),
+    ("slate grey", "#708090"),
+    ("snow", "#fffafa"),
+    ("spring green", "#00ff7f"),
+    ("steel blue", "#4682b4"),
+    ("tan", "#d2b48c"),
+    ("teal", "#008080"),
+    ("thistle", "#d8bfd8"),
+    ("tomato", "#ff6347"),
+    ("turquoise", "#40e0d0"),
+    ("violet", "#ee82ee"),
+    ("wheat", "#f5deb3"),
+    ("white", "#ffffff"),
+    ("white smoke", "#f5f5f5"),
+    ("yellow", "#ffff00"),
+    ("yellow green", "#9acd32"),
+)
+
+FASHION_COLOURS = (
+    ("amber", "#ffbf00"),
+    ("apricot", "#fbceb1"),
+    ("aubergine", "#3d0734"),
+    ("berry", "#990f4b"),
+    ("blush", "#de5d83"),
+    ("bordeaux", "#5c0120"),
+    ("bronze", "#cd7f32"),
+    ("burgundy", "#800020"),
+    ("burnt orange", "#cc5500"),
+    ("burnt sienna", "#e97451"),
+    ("butter yellow", "#fffd74"),
+    ("camel", "#c19a6b"),
+    ("candy pink", "#e4717a"),
+    ("caramel", "#af6e4d"),
+    ("champagne", "#f7e7ce"),
+    ("charcoal", "#36454f"),
+    ("cherry", "#de3163"),
+    ("chestnut", "#954535"),
+    ("cinnamon", "#d2691e"),
+    ("cobalt", "#0047ab"),
+    ("cognac", "#9a463d"),
+    ("copper", "#b87333"),
+    ("coral pink", "#f88379"),
+    ("cream", "#fffdd0"),
+    ("denim", "#1560bd"),
+    ("dusty pink", "#d4a5a5"),
+    ("dusty rose", "#c0808a"),
+    ("ecru", "#c2b280"),
+    ("eggplant", "#614051"),
+    ("emerald", "#50c878"),
+    ("fern green", "#4f7942"),
+    ("forest", "#0b6623"),
+    ("fuchsia pink", "#ff77ff"),
+    ("hunter green", "#355e3b"),
+    ("ice blue", "#d6ecef"),
+    ("jade", "#00a86b"),
+    ("lilac", "#c8a2c8"),
+    ("mauve", "#e0b0ff"),
+    ("mint", "#98ff98"),
+    ("mocha", "#967969"),
+    ("mulberry", "#c54b8c"),
+    ("mustard", "#ffdb58"),
+    ("mustard yellow", "#e1ad01"),
+    ("navy blue", "#000080"),
+    ("nude", "#e3bc9a"),
+    ("ochre", "#cc7722"),
+    ("olive green", "#708238"),
+    ("oxblood", "#4a0000"),
+    ("pastel blue", "#aec6cf"),
+    ("pastel pink", "#ffd1dc"),
+    ("peach", "#ffe5b4"),
+    ("periwinkle", "#ccccff"),
+    ("petrol blue", "#005f6a"),
+    ("pewter", "#96a8a1"),
+    ("pistachio", "#93c572"),
+    ("plum purple", "#8e4585"),
+    ("raspberry", "#e30b5c"),
+    ("rose", "#ff007f"),
+    ("rose gold", "#b76e79"),
+    ("rosewood", "#65000b"),
+    ("ruby", "#e0115f"),
+    ("rust", "#b7410e"),
+    ("saffron", "#f4c430"),
+    ("sage", "#bcb88a"),
+    ("sand", "#c2b280"),
+    ("sapphire", "#0f52ba"),
+    ("scarlet", "#ff2400"),
+    ("slate", "#708090"),
+    ("stone", "#928e85"),
+    ("taupe", "#483c32"),
+    ("terracotta", "#e2725b"),
+    ("topaz", "#ffc87c"),
+    ("ultramarine", "#3f00ff"),
+    ("vermilion", "#e34234"),
+    ("wine", "#722f37"),
+)
+
+COLOUR_NAMES = CSS_COLOURS + FASHION_COLOURS
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
+
+# Asks a streamed completion to end with a chunk carrying its token usage.
+# Sent as extra_body since the pinned client predates the stream_options argument.
+STREAM_USAGE = {"stream_options": {"include_usage": True}}
+
+
+class EventLoopThread:
+    """
+    A persistent asyncio event loop running on a daemon thread.
+
+    Every async OpenAI call in the process runs on this one loop, so the
+    HTTP connection pools of the async clients stay alive between requests
+    instead of being torn down with a per-request loop.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """
+        The running loop, started on first use.
+        """
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever, name="llm-dispatcher", daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the loop.
+
+        Parameters:
+            coro (coroutine): The coroutine to run.
+
+        Returns:
+            concurrent.futures.Future: Future of the result; cancelling it cancels the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the loop and block until it finishes.
+
+        Parameters:
+            coro (coroutine): The coroutine to run.
+            timeout (float, optional): Seconds to wait before cancelling it.
+
+        Returns:
+            The coroutine's result.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+
+_loop_thread = EventLoopThread()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_loop_thread():
+    """
+    Return the process-wide dispatcher loop.
+    """
+    return _loop_thread
+
+
+def get_async_client(api_key: str, base_url=None, max_retries=2):
+    """
+    Return a shared AsyncOpenAI client for the given credentials.
+
+    Parameters:
+        api_key (str): OpenAI API key.
+        base_url (str, optional): OpenAI-compatible endpoint, e.g. a local mock server.
+        max_retries (int): Retries done by the client itself; 0 when a
+            RateLimitScheduler handles retries.
+
+    Returns:
+        AsyncOpenAI: A client whose connection pool is reused across requests.
+    """
+    key = (api_key, base_url, max_retries)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = AsyncOpenAI(
+                api_key=api_key, base_url=base_url, max_retries=max_retries
+            )
+        return client
+
+
+def chunk_usage(chunk):
+    """
+    Token usage carried by a stream chunk, which is only the last one when STREAM_USAGE is sent.
+
+    Returns:
+        CompletionUsage: The usage, or None.
+    """
+    usage = getattr(chunk, "usage", None)
+    if isinstance(usage, dict):
+        # Clients without the usage field keep it as a plain dict.
+        usage = CompletionUsage(**usage)
+    return usage
@@ -0,0 +1,373 @@
+"""
+Deterministic colour-harmony palettes computed locally from feature colours.
+
+The facial feature colours are classified in CIE LAB into undertone
+(warm, neutral, cool), value (light, medium, deep) and contrast (low,
+medium, high). Harmony rules in LCh then place the good, bad and blush
+colours, and each colour is named after its nearest neighbour in a
+named-colour table, without repeating a name within a palette. A call
+takes about 0.7 ms (local/harmony_palettes in benchmarks/baseline.json),
+so the engine can stand in for the LLM when the API is slow or down, or
+seed the prompt so the model only writes the rationales.
+"""
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from chat_llm.colour_names import COLOUR_NAMES
+from chat_llm.palettes import PALETTE_KINDS, PALETTE_SIZE, PaletteEntry
+
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124, 0.3576, 0.1805],
+        [0.2126, 0.7152, 0.0722],
+        [0.0193, 0.1192, 0.9505],
+    ]
+)
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+
+# Chroma multipliers tried, in order, to bring a colour into the sRGB gamut.
+_GAMUT_STEPS = np.linspace(1.0, 0.0, 21)
+
+
+def rgb_to_lab(rgb):
+    """
+    Convert sRGB to CIE LAB (D65), matching palette_cache.hex_to_lab.
+
+    Parameters:
+        rgb (numpy.ndarray): (..., 3) array of R, G, B in 0-255.
+
+    Returns:
+        numpy.ndarray: (..., 3) float array of L, a, b.
+    """
+    c = np.asarray(rgb, dtype=float) / 255
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    t = linear @ _RGB_TO_XYZ.T / _WHITE
+    f = np.where(t > 0.008856, np.cbrt(t), 7.787 * t + 16 / 116)
+    return np.stack(
+        [116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1
+    )
+
+
+def _lab_to_linear(lab):
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    t = np.where(f ** 3 > 0.008856, f ** 3, (f - 16 / 116) / 7.787)
+    return (t * _WHITE) @ _XYZ_TO_RGB.T
+
+
+def lab_to_rgb(lab):
+    """
+    Convert CIE LAB to sRGB, clipping colours outside the gamut.
+
+    Parameters:
+        lab (numpy.ndarray): (..., 3) array of L, a, b.
+
+    Returns:
+        numpy.ndarray: (..., 3) uint8 array of R, G, B.
+    """
+    linear = np.clip(_lab_to_linear(lab), 0, 1)
+    c = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * linear ** (1 / 2.4) - 0.055)
+    return np.rint(c * 255).astype(np.uint8)
+
+
+def lch_to_lab(lch):
+    """
+    Convert (L, C, h in degrees) rows to LAB.
+    """
+    lch = np.asarray(lch, dtype=float)
+    h = np.radians(lch[..., 2])
+    return np.stack([lch[..., 0], lch[..., 1] * np.cos(h), lch[..., 1] * np.sin(h)], axis=-1)
+
+
+def fit_gamut(lch):
+    """
+    Lower each colour's chroma, keeping lightness and hue, until it fits in sRGB.
+
+    Parameters:
+        lch (numpy.ndarray): (N, 3) array of L, C, h.
+
+    Returns:
+        numpy.ndarray: (N, 3) LAB array of displayable colours.
+    """
+    lch = np.asarray(lch, dtype=float)
+    trials = np.repeat(lch[:, None, :], len(_GAMUT_STEPS), axis=1)
+    trials[..., 1] *= _GAMUT_STEPS
+    lab = lch_to_lab(trials)
+    linear = _lab_to_linear(lab)
+    fits = np.all((linear >= -1e-4) & (linear <= 1 + 1e-4), axis=-1)
+    # The last step has zero chroma, which is always in gamut for 0 <= L <= 100.
+    fits[:, -1] = True
+    return lab[np.arange(len(lch)), fits.argmax(axis=1)]
+
+
+def _hex_to_rgb(hexcode):
+    hexcode = hexcode.lstrip("#")
+    return [int(hexcode[i:i + 2], 16) for i in (0, 2, 4)]
+
+
+# Name prefixes of the derived table entries: (lightness shift, chroma scale).
+_VARIANTS = {"light": (14.0, 1.0), "deep": (-14.0, 1.0), "muted": (0.0, 0.5)}
+# Names starting with one of these are not given derived variants.
+_MODIFIERS = {"light", "dark", "deep", "pale", "muted", "medium", "dusty", "pastel", "burnt"}
+# X11 "brown" is a dark red; lightened, it would label reds "light brown".
+_NO_VARIANTS = {"brown"}
+# Below this chroma a colour reads as black, white or grey, and "light
+# black" or "muted grey" mean nothing.
+_ACHROMATIC_CHROMA = 8.0
+# ΔE added to derived entries, so a plain name wins unless a variant is clearly closer.
+_VARIANT_PENALTY = 4.0
+
+
+class ColourNameIndex:
+    """
+    Nearest-neighbour lookup from LAB colours to names.
+
+    Each chromatic named colour is also indexed in light, deep and muted
+    variants, so the table is dense enough that generated colours get a
+    close name.
+    """
+
+    def __init__(self, names=COLOUR_NAMES):
+        base = rgb_to_lab(np.array([_hex_to_rgb(hexcode) for _, hexcode in names]))
+        labels = [name for name, _ in names]
+        lab = [base]
+        plain = np.array(
+            [
+                name.split()[0] not in _MODIFIERS and name not in _NO_VARIANTS
+                for name in labels
+            ]
+        ) & (np.hypot(base[:, 1], base[:, 2]) >= _ACHROMATIC_CHROMA)
+        for prefix, (shift, scale) in _VARIANTS.items():
+            variant = base[plain].copy()
+            variant[:, 0] = np.clip(variant[:, 0] + shift, 0, 100)
+            variant[:, 1:] *= scale
+            lab.append(variant)
+            labels.extend(f"{prefix} {name}" for name, keep in zip(labels[:len(names)], plain) if keep)
+        self.lab = np.concatenate(lab)
+        self.names = labels
+        self._penalty = np.where(np.arange(len(labels)) < len(names), 0.0, _VARIANT_PENALTY)
+        # |x - y|^2 = |x|^2 - 2 x.y + |y|^2; the table half is precomputed.
+        self._lab_t = self.lab.T * -2
+        self._norms = (self.lab ** 2).sum(axis=1)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _distances(self, lab):
+        lab = np.asarray(lab, dtype=float).reshape(-1, 3)
+        squared = lab @ self._lab_t + self._norms + (lab ** 2).sum(axis=1, keepdims=True)
+        return np.sqrt(np.maximum(squared, 0)) + self._penalty
+
+    def nearest(self, lab, group=None):
+        """
+        Names of the closest table colours (CIE76 ΔE).
+
+        Parameters:
+            lab (numpy.ndarray): (N, 3) LAB colours.
+            group (int, optional): Give the colours in each run of this many
+                different names, taking the next closest name when an
+                earlier colour in the run already has one.
+
+        Returns:
+            list: One name per colour.
+        """
+        distances = self._distances(lab)
+        if group is None:
+            return [self.names[i] for i in distances.argmin(axis=1)]
+        # A colour needs at most group closest names to find an unused one.
+        count = min(group, len(self.names)) - 1
+        closest = np.argpartition(distances, count, axis=1)[:, :count + 1]
+        names = []
+        for n, (row, candidates) in enumerate(zip(distances, closest)):
+            taken = names[n - n % group:]
+            for i in candidates[np.argsort(row[candidates])]:
+                if self.names[i] not in taken:
+                    names.append(self.names[i])
+                    break
+        return names
+
+
+class Colouring(NamedTuple):
+    """
+    Classification of a face's colouring.
+    """
+
+    undertone: str
+    value: str
+    contrast: str
+    skin: tuple
+    eyes: tuple
+    lips: tuple
+
+
+def _lch(lab):
+    L, a, b = lab
+    return L, math.hypot(a, b), math.degrees(math.atan2(b, a)) % 360
+
+
+# Skin chroma below which the undertone is neutral whatever the hue.
+_NEUTRAL_CHROMA = 5.0
+
+
+def classify(hexcodes):
+    """
+    Classify undertone, value and contrast from the feature colours.
+
+    Skin is the mean of the nose and jaw colours. Undertone comes from the
+    skin hue angle in a*b* (yellower is warm, pinker is cool, and neutral
+    when the skin has almost no chroma), value from
+    the skin lightness, and contrast from the lightness gap between skin
+    and eyes.
+
+    Parameters:
+        hexcodes (tuple): Left eye, right eye, nose, jaw and lips hexcodes.
+
+    Returns:
+        Colouring: The classification and the LAB colours it was based on.
+    """
+    lab = rgb_to_lab(np.array([_hex_to_rgb(h) for h in hexcodes]))
+    skin = lab[2:4].mean(axis=0)
+    eyes = lab[0:2].mean(axis=0)
+    lips = lab[4]
+
+    _, chroma, hue = _lch(skin)
+    if chroma < _NEUTRAL_CHROMA:
+        # A grey skin colour has no meaningful hue angle.
+        undertone = "neutral"
+    else:
+        undertone = "warm" if hue >= 62 else "cool" if hue <= 48 else "neutral"
+    value = "light" if skin[0] >= 68 else "deep" if skin[0] <= 45 else "medium"
+    gap = abs(skin[0] - eyes[0])
+    contrast = "high" if gap >= 35 else "low" if gap <= 18 else "medium"
+    return Colouring(undertone, value, contrast, tuple(skin), tuple(eyes), tuple(lips))
+
+
+# Hue (degrees) the palette is pulled towards for each undertone.
+_UNDERTONE_HUE = {"warm": 65.0, "neutral": None, "cool": 290.0}
+# Chroma of the good palette for each contrast level.
+_CONTRAST_CHROMA = {"low": 30.0, "medium": 45.0, "high": 60.0}
+# Lightness of the good palette: away from the skin value so colours stand out.
+_VALUE_LIGHTNESS = {"light": 48.0, "medium": 58.0, "deep": 70.0}
+
+
+def _pull(hue, target, amount=0.25):
+    """
+    Rotate hue a fraction of the way towards target along the shorter arc.
+    """
+    if target is None:
+        return hue % 360
+    delta = (target - hue + 180) % 360 - 180
+    return (hue + amount * delta) % 360
+
+
+class HarmonyEngine:
+    """
+    Rule-based palette generator with named colours.
+    """
+
+    def __init__(self, index=None):
+        """
+        Parameters:
+            index (ColourNameIndex, optional): Name lookup; a default one is built if not given.
+        """
+        self.index = index or ColourNameIndex()
+
+    def _good(self, c):
+        skin_L, _, skin_h = _lch(c.skin)
+        _, eye_c, eye_h = _lch(c.eyes)
+        target = _UNDERTONE_HUE[c.undertone]
+        L = _VALUE_LIGHTNESS[c.value]
+        C = _CONTRAST_CHROMA[c.contrast]
+        spread = {"low": 6.0, "medium": 12.0, "high": 20.0}[c.contrast]
+        accent = eye_h + 180 if eye_c >= 8 else skin_h + 180
+        return [
+            (L, C, _pull(skin_h + 30, target), "Analogous to your skin tone, it warms the face without competing with it."),
+            (L - spread, C, _pull(skin_h - 30, target), "A deeper analogous shade that frames your skin tone."),
+            (L, C, _pull(accent, target), "Opposite your eye colour on the colour wheel, so it makes your eyes stand out."),
+            (L + spread, C * 0.8, _pull(skin_h + 120, target), "A triadic partner to your skin tone for balanced contrast."),
+            (100 - skin_L * 0.6, 10.0, skin_h, "A soft neutral in your own undertone that works as a base colour."),
+        ]
+
+    def _bad(self, c):
+        skin_L, skin_c, skin_h = _lch(c.skin)
+        opposite = {"warm": 250.0, "cool": 75.0, "neutral": (skin_h + 180) % 360}[c.undertone]
+        C = {"low": 70.0, "medium": 20.0, "high": 12.0}[c.contrast]
+        return [
+            (skin_L, skin_c + 5, skin_h, "Too close to your skin tone, so it washes the face out."),
+            (skin_L + 5, C, opposite, f"Its {'cool' if c.undertone == 'warm' else 'warm'} cast fights your {c.undertone} undertone."),
+            (min(skin_L + 20, 95), C * 0.6, opposite + 20, "A pale clashing tint that drains colour from the face."),
+            (skin_L - 10, 8.0, skin_h + 90, "A muddy mid-tone that dulls your complexion."),
+            (skin_L, 75.0, opposite - 30, "So saturated at your skin's lightness that it overpowers your features."),
+        ]
+
+    def _blush(self, c):
+        skin_L = c.skin[0]
+        lips_L, lips_c, lips_h = _lch(c.lips)
+        target = {"warm": 40.0, "neutral": None, "cool": 355.0}[c.undertone]
+        # Grey lips have no hue to follow; start from a rose.
+        hue = _pull(lips_h if lips_c >= _NEUTRAL_CHROMA else 10.0, target, 0.5)
+        C = max(lips_c, 30.0)
+        # Between skin and lips, but at least 8 L* apart so the shades stay distinct.
+        middle = skin_L + (lips_L - skin_L) * 0.55
+        spacing = max(abs(lips_L - skin_L) * 0.15, 8.0)
+        rows = []
+        for step, rationale in enumerate(
+            [
+                "A sheer flush close to your natural lip colour.",
+                "A soft everyday blush that follows your lip undertone.",
+                "A fresh mid-tone that brightens the cheeks.",
+                "A richer shade for evening that still matches your lips.",
+                "A deep, bold flush in the same family as your lips.",
+            ]
+        ):
+            L = middle - spacing * (step - 2)
+            rows.append((L, C * (0.7 + 0.1 * step), hue + 8 * (step - 2), rationale))
+        return rows
+
+    def palettes(self, hexcodes):
+        """
+        Generate the good, bad and blush palettes.
+
+        Parameters:
+            hexcodes (tuple): Left eye, right eye, nose, jaw and lips hexcodes.
+
+        Returns:
+            dict: Maps each kind in PALETTE_KINDS to a list of PALETTE_SIZE PaletteEntry.
+        """
+        c = classify(hexcodes)
+        rows = self._good(c) + self._bad(c) + self._blush(c)
+        lch = np.array([(L, C, h % 360) for L, C, h, _ in rows])
+        lch[:, 0] = np.clip(lch[:, 0], 5, 97)
+        rgb = lab_to_rgb(fit_gamut(lch))
+        names = self.index.nearest(rgb_to_lab(rgb), group=PALETTE_SIZE)
+        entries = [
+            PaletteEntry(int(r) << 16 | int(g) << 8 | int(b), name, row[3])
+            for (r, g, b), name, row in zip(rgb, names, rows)
+        ]
+        return {
+            kind: entries[k * PALETTE_SIZE:(k + 1) * PALETTE_SIZE]
+            for k, kind in enumerate(PALETTE_KINDS)
+        }
+
+    def hexcodes(self, hexcodes, kind):
+        """
+        One palette as (hex without '#', name) pairs, the shape hexcode_from_text returns.
+        """
+        return [(entry.hex[1:], entry.name) for entry in self.palettes(hexcodes)[kind]]
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Return the process-wide harmony engine, building its name index on first use.
+    """
+    global _engine
+    if _engine is None:
+        _engine = HarmonyEngine()
+    return _engine
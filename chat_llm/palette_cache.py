@@ -0,0 +1,250 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import get_metrics
+
+
+def hex_to_lab(hexcode: str):
+    """
+    Convert a hexcode to CIE LAB (D65).
+
+    Parameters:
+        hexcode (str): Colour such as "#c34a5b".
+
+    Returns:
+        tuple: (L, a, b) floats.
+    """
+    hexcode = hexcode.lstrip("#")
+    rgb = [int(hexcode[i:i + 2], 16) / 255 for i in (0, 2, 4)]
+    r, g, b = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in rgb]
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+    fx, fy, fz = [t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116 for t in (x, y, z)]
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def quantize_hexcodes(hexcodes, tolerance: float):
+    """
+    Snap hexcodes to a LAB grid whose cell size is the ΔE tolerance.
+
+    Colours that land in the same cells share a cache entry, so users whose
+    features differ by a few RGB units reuse the same palette.
+
+    Parameters:
+        hexcodes (tuple): Hexcodes of the facial features.
+        tolerance (float): Grid cell size in ΔE (CIE76) units.
+
+    Returns:
+        str: Stable key built from the quantized LAB cells.
+    """
+    cells = []
+    for hexcode in hexcodes:
+        cells.extend(round(v / tolerance) for v in hex_to_lab(hexcode))
+    return ",".join(map(str, cells))
+
+
+class PaletteCache:
+    """
+    TTL + LRU cache of LLM palette responses keyed by perceptually quantized hexcodes.
+
+    Entries live in memory and, when a path is given, in a SQLite file that
+    survives restarts. Concurrent lookups of the same missing key share a
+    single in-flight computation.
+    """
+
+    def __init__(self, path=None, tolerance=4.0, ttl=7 * 24 * 3600, max_entries=10_000):
+        """
+        Parameters:
+            path (str, optional): SQLite file for the persistent backend.
+            tolerance (float): ΔE grid size used to quantize hexcodes.
+            ttl (float): Seconds an entry stays valid.
+            max_entries (int): Size limit of each tier.
+        """
+        self.tolerance = tolerance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._ainflight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS palettes ("
+                "key TEXT PRIMARY KEY, content TEXT, created REAL)"
+            )
+            self._db.commit()
+
+    def key(self, kind: str, hexcodes):
+        """
+        Cache key for one palette kind and set of hexcodes.
+        """
+        return f"{kind}:{quantize_hexcodes(hexcodes, self.tolerance)}"
+
+    def _count(self, kind, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        get_metrics().inc("palette_cache_total", kind=kind, result="hit" if hit else "miss")
+
+    def _lookup(self, key):
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                return entry[0]
+            del self._memory[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT content, created FROM palettes WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                self._remember(key, row[0], row[1])
+                return row[0]
+        return None
+
+    def _remember(self, key, content, created):
+        self._memory[key] = (content, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _store(self, key, content):
+        created = time.time()
+        with self._lock:
+            self._remember(key, content, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO palettes VALUES (?, ?, ?)", (key, content, created)
+                )
+                self._db.execute("DELETE FROM palettes WHERE created < ?", (created - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM palettes WHERE key IN ("
+                    "SELECT key FROM palettes ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def lookup(self, kind: str, hexcodes):
+        """
+        Return the cached palette text, or None on a miss.
+        """
+        key = self.key(kind, hexcodes)
+        with self._lock:
+            content = self._lookup(key)
+            self._count(kind, content is not None)
+            return content
+
+    def store(self, kind: str, hexcodes, content: str):
+        """
+        Cache palette text produced outside get_or_compute, e.g. from a stream.
+        """
+        self._store(self.key(kind, hexcodes), content)
+
+    async def _offload(self, fn, *args):
+        # SQLite reads and commits block, so they run off the event loop.
+        if self._db is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def alookup(self, kind: str, hexcodes):
+        """
+        Async counterpart of lookup.
+        """
+        return await self._offload(self.lookup, kind, hexcodes)
+
+    async def astore(self, kind: str, hexcodes, content: str):
+        """
+        Async counterpart of store.
+        """
+        await self._offload(self.store, kind, hexcodes, content)
+
+    def get_or_compute(self, kind: str, hexcodes, compute):
+        """
+        Return the cached palette, or compute it exactly once across concurrent callers.
+
+        Parameters:
+            kind (str): Palette kind, e.g. "good", "bad" or "blush".
+            hexcodes (tuple): Hexcodes the palette depends on.
+            compute (callable): Produces the palette text on a miss.
+
+        Returns:
+            str: The palette text.
+        """
+        key = self.key(kind, hexcodes)
+        with self._lock:
+            content = self._lookup(key)
+            self._count(kind, content is not None)
+            if content is not None:
+                return content
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            return future.result()
+        try:
+            content = compute()
+            self._store(key, content)
+            future.set_result(content)
+            return content
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_compute(self, kind: str, hexcodes, compute):
+        """
+        Async counterpart of get_or_compute.
+
+        Concurrent awaits of the same missing key on one event loop share a
+        single in-flight task; cancelling one waiter does not cancel it.
+
+        Parameters:
+            kind (str): Palette kind, e.g. "good", "bad" or "blush".
+            hexcodes (tuple): Hexcodes the palette depends on.
+            compute (callable): Returns a coroutine producing the palette text.
+
+        Returns:
+            str: The palette text.
+        """
+        key = self.key(kind, hexcodes)
+        content = await self.alookup(kind, hexcodes)
+        if content is not None:
+            return content
+
+        task = self._ainflight.get(key)
+        if task is None:
+            async def run():
+                try:
+                    content = await compute()
+                    await self._offload(self._store, key, content)
+                    return content
+                finally:
+                    self._ainflight.pop(key, None)
+
+            task = self._ainflight[key] = asyncio.ensure_future(run())
+            # Waiters may all time out first; the failure is theirs to report.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    def counters(self):
+        """
+        Hit and miss counters.
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
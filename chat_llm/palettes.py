@@ -0,0 +1,180 @@
+import json
+import re
+from typing import NamedTuple
+
+# Palette kinds in the order they are shown in the app.
+PALETTE_KINDS = ("good", "bad", "blush")
+
+# Colours the model is asked for in each palette.
+PALETTE_SIZE = 5
+
+_HEX_RE = re.compile(r"^#?([0-9a-fA-F]{6})$")
+
+_ENTRY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "hex": {"type": "string", "description": "Colour as #rrggbb"},
+        "name": {"type": "string"},
+        "rationale": {"type": "string"},
+    },
+    "required": ["hex", "name", "rationale"],
+    "additionalProperties": False,
+}
+
+# response_format for a completion returning all three palettes at once.
+PALETTES_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "palettes",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                kind: {"type": "array", "items": _ENTRY_SCHEMA} for kind in PALETTE_KINDS
+            },
+            "required": list(PALETTE_KINDS),
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class PaletteEntry(NamedTuple):
+    """
+    One suggested colour.
+    """
+
+    hexcode: int
+    name: str
+    rationale: str
+
+    @property
+    def hex(self):
+        """
+        The colour as a "#rrggbb" string.
+        """
+        return f"#{self.hexcode:06x}"
+
+
+def parse_palettes_json(text: str):
+    """
+    Validates a structured palette response into PaletteEntry lists.
+
+    Parameters:
+        text (str): JSON matching PALETTES_RESPONSE_FORMAT.
+
+    Returns:
+        dict: Maps each kind in PALETTE_KINDS to a list of PaletteEntry.
+
+    Raises:
+        ValueError: If the JSON is malformed or a palette is incomplete.
+    """
+    data = json.loads(text)
+    palettes = {}
+    for kind in PALETTE_KINDS:
+        items = data.get(kind) if isinstance(data, dict) else None
+        if not isinstance(items, list) or len(items) < PALETTE_SIZE:
+            raise ValueError(f"{kind} palette needs {PALETTE_SIZE} colours")
+        entries = []
+        for item in items[:PALETTE_SIZE]:
+            match = _HEX_RE.match(str(item.get("hex", "")).strip())
+            if match is None:
+                raise ValueError(f"invalid hexcode in {kind} palette: {item.get('hex')!r}")
+            entries.append(
+                PaletteEntry(
+                    int(match.group(1), 16),
+                    str(item.get("name", "")).strip(),
+                    str(item.get("rationale", "")).strip(),
+                )
+            )
+        palettes[kind] = entries
+    return palettes
+
+
+def format_palette(entries):
+    """
+    Renders entries in the numbered "#rrggbb (name): rationale" text format.
+
+    Parameters:
+        entries (list): PaletteEntry records.
+
+    Returns:
+        str: Text that hexcode_from_text can parse.
+    """
+    return "\n".join(
+        f"{i}. {entry.hex} ({entry.name}): {entry.rationale}"
+        for i, entry in enumerate(entries, start=1)
+    )
+
+
+_LINE_RE = re.compile(
+    r"^\s*\d+\.\s*#([0-9a-fA-F]{6})\s*\(([^)]+)\)\s*[:\-–]?\s*(.*)$", re.MULTILINE
+)
+
+
+def parse_palette_line(line: str):
+    """
+    Parses one numbered "N. #rrggbb (name): rationale" line.
+
+    Parameters:
+        line (str): A single line of model output.
+
+    Returns:
+        PaletteEntry: The parsed entry, or None if the line is not an entry.
+    """
+    match = _LINE_RE.match(line)
+    if match is None:
+        return None
+    return PaletteEntry(int(match.group(1), 16), match.group(2).strip(), match.group(3).strip())
+
+
+def parse_palette_text(text: str):
+    """
+    Parses a whole numbered palette response in a single regex pass.
+
+    Lines that do not look like entries are skipped, so a malformed response
+    yields fewer (or no) entries rather than an error.
+
+    Parameters:
+        text (str): Model output in the "N. #rrggbb (name): rationale" format.
+
+    Returns:
+        list: PaletteEntry records in order.
+    """
+    return [
+        PaletteEntry(int(match.group(1), 16), match.group(2).strip(), match.group(3).strip())
+        for match in _LINE_RE.finditer(text or "")
+    ]
+
+
+class PaletteLineBuffer:
+    """
+    Turns streamed text deltas into PaletteEntry records as each line completes.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pending = ""
+
+    def feed(self, delta: str):
+        """
+        Adds a text delta.
+
+        Returns:
+            list: Entries completed by this delta.
+        """
+        self.text += delta
+        self._pending += delta
+        *lines, self._pending = self._pending.split("\n")
+        return [entry for entry in map(parse_palette_line, lines) if entry is not None]
+
+    def close(self):
+        """
+        Flushes the last, unterminated line.
+
+        Returns:
+            list: The entry on that line, if any.
+        """
+        line, self._pending = self._pending, ""
+        entry = parse_palette_line(line)
+        return [] if entry is None else [entry]
@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+import openai
+
+from chat_llm.dispatcher import chunk_usage
+from metrics import get_metrics
+
+# Request priorities; lower values are served first.
+INTERACTIVE = 0
+BATCH = 1
+
+# Completion tokens assumed for a palette answer before the real usage is known.
+EXPECTED_COMPLETION_TOKENS = 400
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request cannot be started or retried before its deadline.
+    """
+
+
+def estimate_tokens(messages, completion_tokens=EXPECTED_COMPLETION_TOKENS):
+    """
+    Rough token count of a chat request, about four characters per token.
+
+    Parameters:
+        messages (list): Chat messages to send.
+        completion_tokens (int): Tokens expected in the answer.
+
+    Returns:
+        int: Estimated prompt plus completion tokens.
+    """
+    return sum(len(m.get("content") or "") for m in messages) // 4 + completion_tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget of `per_minute` units.
+
+    The level may go negative when a request turns out to cost more than
+    estimated; later requests then wait until the debt is refilled.
+    """
+
+    def __init__(self, per_minute: float, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float):
+        """
+        Seconds until amount units are available.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        """
+        Spend amount units; a negative amount refunds an overestimate, up to capacity.
+        """
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class ScheduledStream:
+    """
+    Streamed completion that holds its scheduler slot until it is read to the end or closed.
+
+    create(stream=True) returns as soon as the headers arrive, so releasing
+    the slot then would let any number of bodies stream at once. The real
+    token usage from the final chunk, when requested, corrects the estimate
+    charged up front.
+    """
+
+    def __init__(self, stream, scheduler, tokens: int):
+        self._stream = stream
+        self._scheduler = scheduler
+        self._tokens = tokens
+        self._closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                usage = chunk_usage(chunk)
+                if usage is not None:
+                    self._scheduler.tokens.take(usage.total_tokens - self._tokens)
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Close the underlying stream and free the slot; safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._scheduler.release()
+        await self._stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class RateLimitScheduler:
+    """
+    Shared client-side limiter and retry scheduler for OpenAI calls.
+
+    Requests wait for a concurrency slot and for both the requests-per-minute
+    and tokens-per-minute buckets, served in priority order (interactive
+    before batch, then first come first served). Rate-limit and transient
+    errors are retried with jittered exponential backoff, honouring
+    Retry-After; a 429 also pauses every other request for that long so a
+    spike does not turn into an error storm. Must be used from a single
+    event loop.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=3500,
+        tokens_per_minute=90_000,
+        max_concurrency=16,
+        max_retries=5,
+        base_delay=0.5,
+        max_delay=30.0,
+    ):
+        """
+        Parameters:
+            requests_per_minute (float): Request quota.
+            tokens_per_minute (float): Token quota.
+            max_concurrency (int): Requests allowed in flight at once.
+            max_retries (int): Retries per request after the first attempt.
+            base_delay (float): First backoff delay in seconds.
+            max_delay (float): Cap on a single backoff delay in seconds.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.active = 0
+        self._paused_until = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+
+    def _pump(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters and self.active < self.max_concurrency:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self.requests.delay(1),
+                self.tokens.delay(tokens),
+            )
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, tokens: int, priority=INTERACTIVE, deadline=None):
+        """
+        Wait for a slot and rate budget.
+
+        Parameters:
+            tokens (int): Estimated tokens of the request.
+            priority (int): INTERACTIVE or BATCH.
+            deadline (float, optional): time.monotonic() value to give up at.
+
+        Raises:
+            DeadlineExceeded: If the budget is not available before deadline.
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._pump()
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self.release()
+            future.cancel()
+            raise DeadlineExceeded("no rate budget before the deadline")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            future.cancel()
+            raise
+
+    def release(self):
+        """
+        Free a concurrency slot taken by acquire.
+        """
+        self.active -= 1
+        self._pump()
+
+    def _backoff(self, error, attempt):
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("retry-after-ms")
+        if retry_after is not None:
+            return float(retry_after) / 1000
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _retryable(error):
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return getattr(error, "status_code", None) in _RETRYABLE_STATUS
+
+    async def run(self, call, tokens: int, priority=INTERACTIVE, deadline=None):
+        """
+        Run call under the limits, retrying rate-limit and transient errors.
+
+        Parameters:
+            call (callable): Returns a coroutine performing the request.
+            tokens (int): Estimated tokens of the request.
+            priority (int): INTERACTIVE or BATCH.
+            deadline (float, optional): time.monotonic() value to give up at.
+
+        Returns:
+            The call's result; a stream is wrapped in a ScheduledStream,
+            which keeps the slot until it is consumed or closed.
+        """
+        metrics = get_metrics()
+        for attempt in itertools.count():
+            await self.acquire(tokens, priority, deadline)
+            streaming = False
+            try:
+                result = await call()
+            except Exception as e:
+                if not self._retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(e, attempt)
+                status = getattr(e, "status_code", None)
+                metrics.inc("llm_retries_total", status=status or type(e).__name__)
+                if status == 429:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise DeadlineExceeded("retry would exceed the deadline") from e
+            else:
+                if isinstance(result, openai.AsyncStream):
+                    streaming = True
+                    return ScheduledStream(result, self, tokens)
+                usage = getattr(result, "usage", None)
+                if usage is not None:
+                    self.tokens.take(usage.total_tokens - tokens)
+                return result
+            finally:
+                if not streaming:
+                    self.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,264 @@
+"""
+Face detection and landmark backends.
+
+Every detector returns boxes as an (N, 4) int array of (left, top, right,
+bottom) pixel coordinates plus an (N,) score array, and every landmarker
+returns an (N, 68, 2) int array in the iBUG 68-point layout used by
+faceRecModule.regions, so any detector can be paired with any landmarker.
+
+The detectors and the OpenCV landmarker keep one model instance per
+thread, because cv2.FaceDetectorYN, cv2.dnn.Net and cv2.face.Facemark are
+not safe to call concurrently and dlib does not document its object
+detector as such. The dlib shape predictor is only read during prediction
+and, at about 100 MB, is shared. dlib is imported only when a dlib backend
+is used, so an OpenCV-only install can run the OpenCV backends.
+"""
+import threading
+
+import cv2
+import numpy as np
+
+SHAPE_PREDICTOR_PATH = "shape_predictor_68_face_landmarks.dat"
+YUNET_MODEL_PATH = "face_detection_yunet_2023mar.onnx"
+DNN_CONFIG_PATH = "deploy.prototxt"
+DNN_MODEL_PATH = "res10_300x300_ssd_iter_140000.caffemodel"
+LBF_MODEL_PATH = "lbfmodel.yaml"
+
+# Number of points every landmarker returns.
+LANDMARK_COUNT = 68
+
+
+def _import_dlib():
+    try:
+        import dlib
+    except ImportError as e:
+        raise ImportError(
+            "the dlib backends need the dlib package; install it or select an "
+            "OpenCV backend with FACE_DETECTOR=yunet FACE_LANDMARKER=lbf"
+        ) from e
+    return dlib
+
+
+def _empty_boxes():
+    return np.zeros((0, 4), dtype=int), np.zeros(0, dtype=np.float32)
+
+
+class _PerThreadModel:
+    """
+    Lazily builds one model per thread from a factory.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def get(self):
+        model = getattr(self._local, "model", None)
+        if model is None:
+            model = self._local.model = self._factory()
+        return model
+
+
+class DlibHogDetector:
+    """
+    dlib's HOG + linear SVM frontal face detector.
+    """
+
+    name = "dlib_hog"
+    # Smallest face box, in pixels, the 80x80 detection window finds without upsampling.
+    min_face = 80
+
+    def __init__(self):
+        self._models = _PerThreadModel(lambda: _import_dlib().get_frontal_face_detector())
+
+    def load(self):
+        self._models.get()
+        return self
+
+    def detect(self, img):
+        """
+        Detect faces in a BGR image.
+
+        Returns:
+            tuple: ((N, 4) int boxes, (N,) scores).
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces, scores, _ = self._models.get().run(gray, 0, 0)
+        if not len(faces):
+            return _empty_boxes()
+        boxes = np.array([[f.left(), f.top(), f.right(), f.bottom()] for f in faces], dtype=int)
+        return boxes, np.array(scores, dtype=np.float32)
+
+
+class YuNetDetector:
+    """
+    OpenCV's YuNet CNN face detector (cv2.FaceDetectorYN).
+    """
+
+    name = "yunet"
+    # Smallest face box, in pixels, found reliably.
+    min_face = 20
+
+    def __init__(self, model_path=YUNET_MODEL_PATH, score_threshold=0.8, nms_threshold=0.3):
+        self.model_path = model_path
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self._models = _PerThreadModel(
+            lambda: cv2.FaceDetectorYN.create(
+                self.model_path, "", (320, 320), self.score_threshold, self.nms_threshold
+            )
+        )
+
+    def load(self):
+        self._models.get()
+        return self
+
+    def detect(self, img):
+        height, width = img.shape[:2]
+        model = self._models.get()
+        model.setInputSize((width, height))
+        _, faces = model.detect(img)
+        if faces is None:
+            return _empty_boxes()
+        x, y, w, h = faces[:, :4].T
+        boxes = np.rint(np.stack([x, y, x + w, y + h], axis=1)).astype(int)
+        return boxes, faces[:, 14].astype(np.float32)
+
+
+class DnnDetector:
+    """
+    OpenCV DNN ResNet-10 SSD face detector (res10_300x300 Caffe model).
+    """
+
+    name = "dnn"
+    # The image is resized to input_size first, so the limit is a share of
+    # the image rather than a pixel size.
+    min_face = 0
+
+    def __init__(
+        self, config_path=DNN_CONFIG_PATH, model_path=DNN_MODEL_PATH, score_threshold=0.5, input_size=300
+    ):
+        self.config_path = config_path
+        self.model_path = model_path
+        self.score_threshold = score_threshold
+        self.input_size = input_size
+        self._models = _PerThreadModel(
+            lambda: cv2.dnn.readNetFromCaffe(self.config_path, self.model_path)
+        )
+
+    def load(self):
+        self._models.get()
+        return self
+
+    def detect(self, img):
+        height, width = img.shape[:2]
+        size = (self.input_size, self.input_size)
+        net = self._models.get()
+        net.setInput(
+            cv2.dnn.blobFromImage(cv2.resize(img, size), 1.0, size, (104.0, 177.0, 123.0))
+        )
+        detections = net.forward()[0, 0]
+        detections = detections[detections[:, 2] >= self.score_threshold]
+        if not len(detections):
+            return _empty_boxes()
+        boxes = detections[:, 3:7] * [width, height, width, height]
+        boxes = np.clip(np.rint(boxes), 0, [width - 1, height - 1, width - 1, height - 1])
+        return boxes.astype(int), detections[:, 2].astype(np.float32)
+
+
+class DlibLandmarker:
+    """
+    dlib's 68-point ensemble-of-regression-trees shape predictor.
+    """
+
+    name = "dlib"
+
+    def __init__(self, model_path=SHAPE_PREDICTOR_PATH):
+        self.model_path = model_path
+        self._predictor = None
+
+    def load(self):
+        if self._predictor is None:
+            dlib = _import_dlib()
+            self._predictor = dlib.shape_predictor(self.model_path)
+            self._rectangle = dlib.rectangle
+        return self
+
+    def predict(self, img, boxes):
+        """
+        Predict landmarks for each box of a BGR image.
+
+        Returns:
+            numpy.ndarray: (N, 68, 2) int array of landmarks.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return np.array(
+            [
+                [[p.x, p.y] for p in self._predictor(gray, self._rectangle(*map(int, box))).parts()]
+                for box in boxes
+            ],
+            dtype=int,
+        ).reshape(-1, LANDMARK_COUNT, 2)
+
+
+class LbfLandmarker:
+    """
+    OpenCV contrib Facemark LBF 68-point landmark model (cv2.face).
+    """
+
+    name = "lbf"
+
+    def __init__(self, model_path=LBF_MODEL_PATH):
+        self.model_path = model_path
+        self._models = _PerThreadModel(self._create)
+
+    def _create(self):
+        facemark = cv2.face.createFacemarkLBF()
+        facemark.loadModel(self.model_path)
+        return facemark
+
+    def load(self):
+        self._models.get()
+        return self
+
+    def predict(self, img, boxes):
+        boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+        if not len(boxes):
+            return np.zeros((0, LANDMARK_COUNT, 2), dtype=int)
+        rects = np.column_stack([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]]).astype(np.int32)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        ok, landmarks = self._models.get().fit(gray, rects)
+        if not ok:
+            raise RuntimeError("Facemark LBF failed to fit the face boxes")
+        points = np.concatenate([np.asarray(shape).reshape(-1, 2) for shape in landmarks])
+        return np.rint(points).astype(int).reshape(-1, LANDMARK_COUNT, 2)
+
+
+DETECTORS = {cls.name: cls for cls in (DlibHogDetector, YuNetDetector, DnnDetector)}
+LANDMARKERS = {cls.name: cls for cls in (DlibLandmarker, LbfLandmarker)}
+
+
+def create_detector(name: str, **kwargs):
+    """
+    Build a detector backend by name.
+
+    Args:
+        name (str): One of DETECTORS.
+        **kwargs: Backend options such as model_path or score_threshold.
+    """
+    if name not in DETECTORS:
+        raise ValueError(f"detector must be one of {tuple(DETECTORS)}, got {name!r}")
+    return DETECTORS[name](**kwargs)
+
+
+def create_landmarker(name: str, **kwargs):
+    """
+    Build a landmark backend by name.
+
+    Args:
+        name (str): One of LANDMARKERS.
+        **kwargs: Backend options such as model_path.
+    """
+    if name not in LANDMARKERS:
+        raise ValueError(f"landmarker must be one of {tuple(LANDMARKERS)}, got {name!r}")
+    return LANDMARKERS[name](**kwargs)
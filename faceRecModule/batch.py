@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from faceRecModule.faceFeature import FaceFeatures
+from faceRecModule.models import get_registry
+from faceRecModule.regions import bgr_to_hex
+
+
+class BatchResult:
+    """
+    Stacked landmarks and feature colours for a batch of images.
+
+    Rows for images that failed are zero-filled; use `ok` or `errors` to
+    tell them apart.
+    """
+
+    def __init__(self, sources, landmarks, colours, errors):
+        """
+        Args:
+            sources (list): The inputs, in the order they were given.
+            landmarks (numpy.ndarray): (N, 68, 2) int32 landmark array.
+            colours (numpy.ndarray): (N, 5, 3) uint8 BGR colour array.
+            errors (dict): Maps the index of each failed image to its error message.
+        """
+        self.sources = sources
+        self.landmarks = landmarks
+        self.colours = colours
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def ok(self):
+        """
+        Boolean mask of the images that were processed successfully.
+        """
+        mask = np.ones(len(self.sources), dtype=bool)
+        mask[list(self.errors)] = False
+        return mask
+
+    def hexcodes(self, index):
+        """
+        Hexadecimal colour codes for one image, in FEATURE_NAMES order.
+
+        Args:
+            index (int): Position of the image in the batch.
+
+        Returns:
+            tuple: Hexadecimal color codes of facial features.
+        """
+        return bgr_to_hex(self.colours[index])
+
+
+def _extract_one(source, registry, detect_size):
+    """
+    Run detection, landmark prediction and colour sampling on one image.
+    """
+    faceFeature = FaceFeatures(source, registry=registry, detect_size=detect_size)
+    if faceFeature.img is None:
+        raise ValueError("could not decode image")
+    points = faceFeature.find_face_features()
+    return points, faceFeature.get_features_bgr(points)
+
+
+# Set in each worker process by _init_worker.
+_registry = None
+_detect_size = None
+
+
+def _init_worker(registry, detect_size):
+    global _registry, _detect_size
+    _registry, _detect_size = registry, detect_size
+
+
+def _extract_in_worker(source):
+    return _extract_one(source, _registry, _detect_size)
+
+
+def extract_batch(sources, max_workers=None, registry=None, detect_size=None, processes=False):
+    """
+    Extract landmarks and feature colours for many images on a thread or process pool.
+
+    Every thread uses its own detector instance from the shared registry.
+    Threads only run in parallel while the backends release the GIL; with
+    processes=True the images go to forked worker processes instead, which
+    share the warmed-up models copy-on-write. See benchmarks/run.py for
+    how each scales. A failing image is recorded in the result instead of
+    aborting the batch.
+
+    Args:
+        sources (iterable): Image file paths, encoded bytes or BGR arrays.
+        max_workers (int, optional): Pool size. Defaults to the CPU count.
+        registry (ModelRegistry, optional): Registry holding the loaded models.
+        detect_size (int, optional): Longest side used for face detection.
+        processes (bool): Use a pool of forked processes instead of threads.
+
+    Returns:
+        BatchResult: Stacked landmarks, colours and per-image errors.
+    """
+    sources = list(sources)
+    registry = (registry or get_registry()).warm_up()
+    landmarks = np.zeros((len(sources), 68, 2), dtype=np.int32)
+    colours = np.zeros((len(sources), 5, 3), dtype=np.uint8)
+    errors = {}
+
+    max_workers = max_workers or os.cpu_count()
+    if processes:
+        # The fork start method hands the registry to the workers without pickling it.
+        pool = ProcessPoolExecutor(
+            max_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(registry, detect_size),
+        )
+    else:
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    with pool:
+        if processes:
+            futures = [pool.submit(_extract_in_worker, source) for source in sources]
+        else:
+            futures = [pool.submit(_extract_one, source, registry, detect_size) for source in sources]
+        for i, future in enumerate(futures):
+            try:
+                landmarks[i], colours[i] = future.result()
+            except Exception as e:
+                errors[i] = f"{type(e).__name__}: {e}"
+
+    return BatchResult(sources, landmarks, colours, errors)
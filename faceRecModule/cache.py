@@ -0,0 +1,234 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from faceRecModule.faceFeature import FaceFeatures
+from faceRecModule.models import get_registry
+from faceRecModule.quality import QualityError, check_quality
+from metrics import get_metrics
+
+
+def content_key(data: bytes):
+    """
+    Content address of an encoded image.
+
+    Args:
+        data (bytes): Encoded image.
+
+    Returns:
+        str: SHA-1 hex digest of the bytes.
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+# Bump when a change to detection, landmarking or colour sampling changes
+# results, so entries computed by older code stop matching.
+ANALYSIS_VERSION = 2
+
+
+def analysis_key(data: bytes, registry=None, detect_size=None, reduce=1):
+    """
+    Cache key of an analysis result.
+
+    Covers everything the result depends on besides the image: the detector
+    and landmarker backends, the FaceFeatures options and ANALYSIS_VERSION,
+    so changing any of them never serves results computed the old way.
+
+    Args:
+        data (bytes): Encoded image.
+        registry (ModelRegistry, optional): Registry the analysis runs with.
+        detect_size (int, optional): FaceFeatures detect_size.
+        reduce (int): FaceFeatures reduce.
+
+    Returns:
+        str: SHA-1 hex digest.
+    """
+    backends = (registry or get_registry()).name
+    options = f"v{ANALYSIS_VERSION}:{backends}:detect_size={detect_size}:reduce={reduce}"
+    return hashlib.sha1(f"{content_key(data)}:{options}".encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of face analysis results keyed by analysis_key.
+
+    Each entry holds the (68, 2) landmarks and the (5, 6) region colour
+    statistics. Lookups go to an in-memory LRU first and then to an optional
+    SQLite file, which keeps results across restarts. Both tiers evict the
+    least recently used entries once they hold more than their limit.
+    """
+
+    def __init__(self, path=None, max_memory_entries=1024, max_disk_entries=100_000):
+        """
+        Args:
+            path (str, optional): SQLite file for the persistent tier. None
+                keeps the cache in memory only.
+            max_memory_entries (int): Size limit of the in-memory tier.
+            max_disk_entries (int): Size limit of the persistent tier.
+        """
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "key TEXT PRIMARY KEY, landmarks BLOB, stats BLOB, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS analysis_accessed ON analysis (accessed)")
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Content key of the image.
+
+        Returns:
+            tuple: (landmarks, stats) read-only arrays, or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                get_metrics().inc("analysis_cache_total", result="hit", tier="memory")
+                return entry
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT landmarks, stats FROM analysis WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE analysis SET accessed = ? WHERE key = ?", (time.time(), key)
+                    )
+                    self._db.commit()
+                    entry = (
+                        np.frombuffer(row[0], dtype=np.int32).reshape(68, 2),
+                        np.frombuffer(row[1], dtype=np.uint8).reshape(5, 6),
+                    )
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    get_metrics().inc("analysis_cache_total", result="hit", tier="disk")
+                    return entry
+            self.misses += 1
+            get_metrics().inc("analysis_cache_total", result="miss")
+            return None
+
+    def put(self, key, landmarks, stats):
+        """
+        Store a result in both tiers.
+
+        Args:
+            key (str): Content key of the image.
+            landmarks (numpy.ndarray): (68, 2) array of facial landmarks.
+            stats (numpy.ndarray): (5, 6) region colour statistics.
+
+        Returns:
+            tuple: The stored (landmarks, stats) read-only arrays.
+        """
+        landmarks = np.ascontiguousarray(landmarks, dtype=np.int32)
+        stats = np.ascontiguousarray(stats, dtype=np.uint8)
+        landmarks.flags.writeable = False
+        stats.flags.writeable = False
+        with self._lock:
+            self._remember(key, (landmarks, stats))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?)",
+                    (key, landmarks.tobytes(), stats.tobytes(), time.time()),
+                )
+                self._db.execute(
+                    "DELETE FROM analysis WHERE key IN ("
+                    "SELECT key FROM analysis ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+        return landmarks, stats
+
+    def counters(self):
+        """
+        Hit and miss counters.
+
+        Returns:
+            dict: hits, disk_hits, misses and the in-memory entry count.
+        """
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+        }
+
+
+def analyse_image(data: bytes, gate=False, **kwargs):
+    """
+    Return the landmarks and region colours of an image without the cache.
+
+    With the gate, the face boxes it found are reused, so the detector runs once.
+
+    Args:
+        data (bytes): Encoded image.
+        gate (bool): Run the quality gate before analysing.
+        **kwargs: Passed on to FaceFeatures.
+
+    Returns:
+        tuple: (landmarks, stats) arrays.
+
+    Raises:
+        QualityError: If gate is set and the image fails the quality checks.
+    """
+    detections = None
+    if gate:
+        report = check_quality(data)
+        if not report.ok:
+            raise QualityError(report)
+        detections = report.detections
+    faceFeature = FaceFeatures(data, **kwargs)
+    points = faceFeature.find_face_features(detections)
+    return points, faceFeature.get_features_stats(points)
+
+
+def analyse_cached(data: bytes, cache, gate=False, **kwargs):
+    """
+    Return the landmarks and region colours of an image, using the cache when possible.
+
+    Args:
+        data (bytes): Encoded image.
+        cache (AnalysisCache): Result cache.
+        gate (bool): Run the quality gate before analysing on a miss.
+        **kwargs: Passed on to FaceFeatures on a miss.
+
+    Returns:
+        tuple: (landmarks, stats) arrays.
+
+    Raises:
+        QualityError: If gate is set and the image fails the quality checks.
+    """
+    key = analysis_key(data, **kwargs)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    return cache.put(key, *analyse_image(data, gate=gate, **kwargs))
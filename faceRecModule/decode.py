@@ -0,0 +1,88 @@
+import os
+
+import cv2
+import numpy as np
+
+# cv2.imread/imdecode flags for decoding at 1/1, 1/2, 1/4 and 1/8 resolution.
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# JPEG start-of-frame markers, which carry the image dimensions.
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def image_size(data):
+    """
+    Read the width and height from a JPEG or PNG header without decoding the pixels.
+
+    Args:
+        data (bytes | bytearray | memoryview): The encoded image.
+
+    Returns:
+        tuple: (width, height), or None for other formats or a damaged header.
+    """
+    data = memoryview(data)
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            offset += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = int.from_bytes(data[offset + 5:offset + 7], "big")
+            width = int.from_bytes(data[offset + 7:offset + 9], "big")
+            return width, height
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        offset += 2 + int.from_bytes(data[offset + 2:offset + 4], "big")
+    return None
+
+
+def load_image(source, reduce=1):
+    """
+    Load a BGR image from a path, raw bytes, a buffer, a file object or an array.
+
+    Encoded inputs are decoded in memory with cv2.imdecode, so nothing is
+    written to disk. JPEGs decoded with reduce > 1 are scaled down by the
+    decoder itself, which is much cheaper than decoding at full size and
+    resizing afterwards.
+
+    Args:
+        source (str | os.PathLike | bytes | bytearray | memoryview | file | numpy.ndarray):
+            The image. Arrays are used as-is and must already be BGR.
+        reduce (int): Decode at 1/reduce resolution; one of 1, 2, 4 or 8.
+
+    Returns:
+        numpy.ndarray: BGR image, or None if it could not be decoded.
+    """
+    if reduce not in _REDUCED_FLAGS:
+        raise ValueError(f"reduce must be one of {sorted(_REDUCED_FLAGS)}, got {reduce}")
+    flag = _REDUCED_FLAGS[reduce]
+
+    if isinstance(source, np.ndarray):
+        # A 1-D uint8 array is an encoded buffer; anything else is pixels.
+        if source.ndim == 1:
+            return cv2.imdecode(source, flag)
+        return source
+    if isinstance(source, (str, os.PathLike)):
+        return cv2.imread(os.fspath(source), flag)
+    if hasattr(source, "read"):
+        source = source.read()
+    buffer = np.frombuffer(source, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, flag)
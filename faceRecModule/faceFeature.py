@@ -1,23 +1,60 @@
+from typing import NamedTuple
+
 import cv2
 import numpy as np
-import dlib
+from faceRecModule.decode import load_image
+from faceRecModule.models import get_registry
+from faceRecModule.regions import FEATURE_NAMES, bgr_to_hex, region_statistics
+from metrics import get_metrics
+
+# Face selection policies accepted by FaceFeatures.find_faces.
+FACE_POLICIES = ("largest", "area", "confidence", "all")
+
+
+class NoFaceError(ValueError):
+    """
+    Raised when an image contains no detectable face.
+    """
+
+
+class FaceResult(NamedTuple):
+    """
+    Landmarks of one selected face.
+    """
+
+    box: tuple
+    confidence: float
+    landmarks: np.ndarray
+
 
 class FaceFeatures:
     """
     Class to extract facial features and their colors from an image.
     """
 
-    def __init__(self, filepath: str):
+    def __init__(self, source, registry=None, detect_size=None, reduce=1):
         """
-        Initializes the FaceFeatures object with the given image filepath.
+        Initializes the FaceFeatures object with the given image.
         
         Args:
-            filepath (str): Path to the image file.
+            source (str | bytes | file | numpy.ndarray): Path to the image
+                file, encoded image bytes or buffer, or a decoded BGR array.
+            registry (ModelRegistry, optional): Registry holding the loaded
+                models. Defaults to the process-wide registry.
+            detect_size (int, optional): Longest image side used for face
+                detection. Larger images are downscaled for detection and
+                landmarks are refined on a full-resolution crop around each
+                face. None detects at native resolution.
+            reduce (int): Decode encoded inputs at 1/reduce resolution
+                (1, 2, 4 or 8), useful for very large JPEGs.
         """
-        self.filepath = filepath
-        self.img = cv2.imread(filepath)
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
+        self.filepath = source if isinstance(source, str) else None
+        self.detect_size = detect_size
+        with get_metrics().span("decode"):
+            self.img = load_image(source, reduce=reduce)
+        registry = registry or get_registry()
+        self.detector = registry.detector
+        self.landmarker = registry.landmarker
         self.left_eye_colour = None
         self.right_eye_colour = None
         self.nose_colour = None
@@ -53,66 +90,162 @@ class FaceFeatures:
         hexcode = "#{:02x}{:02x}{:02x}".format(r, g, b)
         return hexcode
 
-    def find_face_features(self):
+    def detect_faces(self):
         """
-        Detect facial landmarks using dlib library.
-        
+        Detect face boxes, downscaling the image first if it is larger than detect_size.
+
         Returns:
-            numpy.ndarray: Array of detected facial landmarks.
+            tuple: (boxes, scores) where boxes is an (N, 4) int array of
+                (left, top, right, bottom) in full-resolution coordinates and
+                scores the detector confidence of each.
         """
-        imgGray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
-        faces = self.detector(imgGray, 0)
-        for face in faces:
-            x1, y1 = face.left(), face.top()
-            x2, y2 = face.right(), face.bottom()
+        height, width = self.img.shape[:2]
+        if not self.detect_size or max(height, width) <= self.detect_size:
+            return self.detector.detect(self.img)
+
+        scale = self.detect_size / max(height, width)
+        imgSmall = cv2.resize(self.img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        boxes, scores = self.detector.detect(imgSmall)
+        return (boxes / scale).astype(int), scores
 
-            landmarks = self.predictor(imgGray, face)
+    def predict_landmarks(self, box, margin=0.25):
+        """
+        Run the landmark model on one face box.
 
-            points = []
-            for n in range(0, 68):
-                x = landmarks.part(n).x
-                y = landmarks.part(n).y
-                points.append([x, y])
-            points = np.array(points)
-        return points
+        Only a crop around the face, grown by margin on each side, is passed
+        to the landmarker, so landmarks are always predicted at full
+        resolution even when detection ran on a downscaled image.
 
-    def get_features_colour(self, points):
+        Args:
+            box (tuple): (left, top, right, bottom) in full-resolution coordinates.
+            margin (float): Crop padding as a fraction of the face size.
+
+        Returns:
+            numpy.ndarray: (68, 2) array of landmarks in full-resolution coordinates.
         """
-        Extract the major color from specific facial feature regions.
-        
+        left, top, right, bottom = (int(v) for v in box)
+        height, width = self.img.shape[:2]
+        pad_x = int((right - left) * margin)
+        pad_y = int((bottom - top) * margin)
+        x1, y1 = max(left - pad_x, 0), max(top - pad_y, 0)
+        x2 = min(right + pad_x, width)
+        y2 = min(bottom + pad_y, height)
+
+        with get_metrics().span("landmark"):
+            landmarks = self.landmarker.predict(
+                self.img[y1:y2, x1:x2], [(left - x1, top - y1, right - x1, bottom - y1)]
+            )
+        return landmarks[0] + [x1, y1]
+
+    def find_faces(self, policy="largest", k=1, detections=None):
+        """
+        Detect faces and run the landmark model only on the ones selected by policy.
+
+        Args:
+            policy (str): "largest" keeps the biggest face, "area" and
+                "confidence" keep the top k faces by box area or detector
+                score, and "all" keeps every face.
+            k (int): Number of faces kept by the "area" and "confidence" policies.
+            detections (tuple, optional): (boxes, scores) from an earlier
+                detection on the same image, with boxes as fractions of the
+                image width and height, e.g. QualityReport.detections. The
+                detector is not run again.
+
+        Returns:
+            list: FaceResult per selected face, empty if no face was found.
+        """
+        if policy not in FACE_POLICIES:
+            raise ValueError(f"policy must be one of {FACE_POLICIES}, got {policy!r}")
+        metrics = get_metrics()
+        if detections is None:
+            with metrics.span("detect", pyramid=bool(self.detect_size)):
+                boxes, scores = self.detect_faces()
+        else:
+            height, width = self.img.shape[:2]
+            boxes = np.rint(detections[0] * [width, height, width, height]).astype(int)
+            scores = detections[1]
+        metrics.inc("faces_detected_total", len(boxes))
+
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        order = list(range(len(boxes)))
+        if policy in ("largest", "area"):
+            order.sort(key=lambda i: areas[i], reverse=True)
+        elif policy == "confidence":
+            order.sort(key=lambda i: scores[i], reverse=True)
+        if policy != "all":
+            order = order[: 1 if policy == "largest" else k]
+
+        return [
+            FaceResult(
+                tuple(int(v) for v in boxes[i]),
+                float(scores[i]),
+                self.predict_landmarks(boxes[i]),
+            )
+            for i in order
+        ]
+
+    def find_face_features(self, detections=None):
+        """
+        Detect facial landmarks of the largest face.
+
+        Args:
+            detections (tuple, optional): Earlier detection to reuse, see find_faces.
+
+        Returns:
+            numpy.ndarray: Array of detected facial landmarks.
+
+        Raises:
+            NoFaceError: If the image contains no face.
+        """
+        faces = self.find_faces("largest", detections=detections)
+        if not faces:
+            raise NoFaceError("no face found in the image")
+        return faces[0].landmarks
+
+    def get_features_stats(self, points):
+        """
+        Median BGR and LAB colour of every facial feature region.
+
         Args:
             points (numpy.ndarray): Array of detected facial landmarks.
 
         Returns:
-            tuple: Hexadecimal color codes of facial features.
+            numpy.ndarray: (5, 6) uint8 array of B, G, R, L, a, b in FEATURE_NAMES order.
         """
-        imgLeftEye_x = (points[36][0] + points[42][0]) // 2
-        imgLeftEye_y = (points[36][1] + points[42][1]) // 2
+        with get_metrics().span("sample"):
+            return region_statistics(self.img, points)
 
-        imgRightEye_x = (points[45][0] + points[39][0]) // 2
-        imgRightEye_y = (points[45][1] + points[39][1]) // 2
+    def get_features_bgr(self, points):
+        """
+        Median BGR colour of every facial feature region.
 
-        imgLips_x = (points[48][0] + points[54][0]) // 2
-        imgLips_y = (points[48][1] + points[54][1]) // 2
+        Args:
+            points (numpy.ndarray): Array of detected facial landmarks.
 
-        imgNose_x = (points[31][0] + points[35][0]) // 2
-        imgNose_y = (points[31][1] + points[35][1]) // 2
+        Returns:
+            numpy.ndarray: (5, 3) uint8 array of BGR colours in FEATURE_NAMES order.
+        """
+        return self.get_features_stats(points)[:, :3]
 
-        imgJaw_x = (points[0][0] + points[16][0]) // 2
-        imgJaw_y = (points[0][1] + points[16][1]) // 2
+    def get_features_colour(self, points):
+        """
+        Extract the major color from specific facial feature regions.
+        
+        Args:
+            points (numpy.ndarray): Array of detected facial landmarks.
 
-        self.left_eye_colour = self.get_hexcode(self.img, (imgLeftEye_x, imgLeftEye_y))
-        self.right_eye_colour = self.get_hexcode(self.img, (imgRightEye_x, imgRightEye_y))
-        self.nose_colour = self.get_hexcode(self.img, (imgNose_x, imgNose_y))
-        self.jaw_colour = self.get_hexcode(self.img, (imgJaw_x, imgJaw_y))
-        self.lips_colour = self.get_hexcode(self.img, (imgLips_x, imgLips_y))
-        return (
+        Returns:
+            tuple: Hexadecimal color codes of facial features.
+        """
+        hexcodes = bgr_to_hex(self.get_features_bgr(points))
+        (
             self.left_eye_colour,
             self.right_eye_colour,
             self.nose_colour,
             self.jaw_colour,
             self.lips_colour,
-        )
+        ) = hexcodes
+        return hexcodes
 
 if __name__ == "__main__":
 
@@ -0,0 +1,112 @@
+import os
+import threading
+
+from faceRecModule.backends import create_detector, create_landmarker
+
+DEFAULT_DETECTOR = "dlib_hog"
+DEFAULT_LANDMARKER = "dlib"
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the face detector and landmark backends.
+
+    Each model is loaded lazily on first use and then shared by every caller
+    in the process, so the landmark model is read from disk only once.
+    """
+
+    def __init__(self, detector=DEFAULT_DETECTOR, landmarker=DEFAULT_LANDMARKER, predictor_path=None):
+        """
+        Initializes the registry without loading any model.
+
+        Args:
+            detector (str | object): Detector backend name or instance.
+            landmarker (str | object): Landmark backend name or instance.
+            predictor_path (str, optional): Path to the dlib 68-point shape
+                predictor file, when the dlib landmarker is selected by name.
+        """
+        if isinstance(detector, str):
+            detector = create_detector(detector)
+        if isinstance(landmarker, str):
+            options = {"model_path": predictor_path} if predictor_path and landmarker == "dlib" else {}
+            landmarker = create_landmarker(landmarker, **options)
+        self._detector_backend = detector
+        self._landmarker_backend = landmarker
+        self._detector = None
+        self._landmarker = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        """
+        Backend pair as "detector+landmarker", e.g. for benchmark labels.
+        """
+        return f"{self._detector_backend.name}+{self._landmarker_backend.name}"
+
+    @property
+    def detector(self):
+        """
+        Return the shared face detector backend, loading it if needed.
+        """
+        if self._detector is None:
+            with self._lock:
+                if self._detector is None:
+                    self._detector = self._detector_backend.load()
+        return self._detector
+
+    @property
+    def landmarker(self):
+        """
+        Return the shared 68-point landmark backend, loading it if needed.
+        """
+        if self._landmarker is None:
+            with self._lock:
+                if self._landmarker is None:
+                    self._landmarker = self._landmarker_backend.load()
+        return self._landmarker
+
+    def warm_up(self):
+        """
+        Load every model up front, e.g. at server start.
+
+        Returns:
+            ModelRegistry: The registry itself.
+        """
+        self.detector
+        self.landmarker
+        return self
+
+    def is_loaded(self):
+        """
+        Check whether both models are already in memory.
+
+        Returns:
+            bool: True if the detector and landmarker are loaded.
+        """
+        return self._detector is not None and self._landmarker is not None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Return the process-wide model registry.
+
+    The backends are read from the FACE_DETECTOR and FACE_LANDMARKER
+    environment variables on first call, so a .env loaded at startup
+    applies.
+
+    Returns:
+        ModelRegistry: The shared registry.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(
+                    os.getenv("FACE_DETECTOR", DEFAULT_DETECTOR),
+                    os.getenv("FACE_LANDMARKER", DEFAULT_LANDMARKER),
+                )
+    return _registry
@@ -0,0 +1,400 @@
+"""
+Pre-forked analysis worker processes that share the loaded models.
+
+The master process loads the face models once, freezes the garbage
+collector so the loaded objects are never written to again, and forks the
+workers. The model pages stay shared copy-on-write between the master and
+every worker, so each extra worker costs only its private memory instead
+of another copy of the models.
+
+Jobs reach the workers through a local queue drained by a dispatcher
+thread, which sends each job to an idle worker over its pipe. Each reply
+carries the counters and histograms the job recorded, which the master
+merges into its own metrics. A worker is replaced after max_jobs jobs or
+once its private memory grows past max_private, and a worker that dies is
+restarted, failing only the job it was running.
+
+Only the first workers are forked before the server runs. Replacements
+are forked by the dispatcher thread while the event loop and other
+threads are running, so a replacement can inherit a lock that one of
+them held at that moment. The child only runs _worker_main: the metrics
+registry is rebuilt after a fork, the logging module reinitialises its
+locks itself, and the dispatcher holds none of the pool's locks while
+forking. Functions run in the workers must not use other state the
+server's threads share, such as the caches' sqlite connections.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import gc
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing.connection import wait
+from typing import NamedTuple
+
+from faceRecModule.models import get_registry
+from metrics import get_metrics, log_event
+
+
+class WorkerCrashed(RuntimeError):
+    """
+    Raised for a job whose worker process died while running it.
+    """
+
+
+class WorkerStats(NamedTuple):
+    """
+    State and memory of one worker process, in bytes.
+    """
+
+    index: int
+    pid: int
+    jobs: int
+    uptime: float
+    rss: int
+    pss: int
+    private: int
+
+
+def process_memory(pid):
+    """
+    Memory of a process from /proc/<pid>/smaps_rollup.
+
+    RSS counts the shared model pages in full for every process, PSS
+    splits them between the processes sharing them, and private is the
+    memory only this process uses.
+
+    Args:
+        pid (int): Process id.
+
+    Returns:
+        dict: rss, pss and private in bytes, or zeros where unavailable.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _worker_main(conn, inherited):
+    # Ctrl-C reaches the whole process group; the master shuts workers down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for other in inherited:
+        other.close()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        fn, args, kwargs = job
+        try:
+            reply = (True, fn(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        # Counters and spans recorded by the job go back with the reply, so
+        # they reach the master's /metrics instead of dying with the worker.
+        delta = get_metrics().drain()
+        try:
+            conn.send(reply + (delta,))
+        except Exception as e:
+            # The result or exception could not be pickled.
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}"), delta))
+
+
+class _Worker:
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+        self.started = time.monotonic()
+        # (future, send time) of the running job, if any.
+        self.job = None
+
+
+class PreforkPool:
+    """
+    Fixed set of forked worker processes that refuses work instead of queueing without limit.
+
+    Offers the same try_submit and pending interface as the backend's
+    thread pool, so either can run the analyses. Functions and arguments
+    are pickled to the workers, so submit module-level functions and plain
+    data.
+    """
+
+    def __init__(self, workers, max_queue, max_jobs=1000, max_private=None, registry=None, report_interval=30.0):
+        """
+        Args:
+            workers (int): Number of worker processes.
+            max_queue (int): Jobs allowed to wait for a worker before try_submit refuses.
+            max_jobs (int): Jobs after which a worker is replaced; 0 never replaces.
+            max_private (int, optional): Private memory in bytes after which a worker is replaced.
+            registry (ModelRegistry, optional): Models to load before forking.
+            report_interval (float): Seconds between worker memory reports.
+        """
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.max_jobs = max_jobs
+        self.max_private = max_private
+        self.report_interval = report_interval
+        self.pending = 0
+        self.restarts = 0
+        self._registry = registry
+        self._context = multiprocessing.get_context("fork")
+        self._queue = collections.deque()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wake_recv, self._wake_send = multiprocessing.Pipe(duplex=False)
+        self._ready = threading.Event()
+        self._closing = False
+        self._error = None
+        self._thread = None
+
+    def start(self):
+        """
+        Load the models and fork the workers, blocking until they are running.
+
+        Returns:
+            PreforkPool: The pool itself.
+        """
+        self._thread = threading.Thread(target=self._run, name="prefork-dispatcher", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def close(self, timeout=5.0):
+        """
+        Stop the workers after their current job and cancel queued jobs.
+        """
+        self._closing = True
+        self._wake_send.send_bytes(b"")
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn for a worker process.
+
+        Returns:
+            concurrent.futures.Future: The result, or None if the pool is saturated.
+        """
+        with self._lock:
+            if self._closing or self.pending >= self.capacity:
+                return None
+            self.pending += 1
+            future = concurrent.futures.Future()
+            future.add_done_callback(self._done)
+            self._queue.append((future, (fn, args, kwargs)))
+        self._wake_send.send_bytes(b"")
+        return future
+
+    def try_submit(self, fn, *args, **kwargs):
+        """
+        Queue fn for a worker process from the event loop.
+
+        Returns:
+            asyncio.Future: The result, or None if the pool is saturated.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        return None if future is None else asyncio.wrap_future(future)
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self):
+        """
+        Memory and job counts of every worker.
+
+        Returns:
+            list: WorkerStats per worker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            workers = [worker for worker in self._workers if worker is not None]
+        return [
+            WorkerStats(
+                worker.index, worker.process.pid, worker.jobs, round(now - worker.started, 1),
+                **process_memory(worker.process.pid),
+            )
+            for worker in workers
+        ]
+
+    def _spawn(self, index):
+        conn, child_conn = self._context.Pipe()
+        # Master-side pipe ends the child inherits and must not hold open:
+        # while it keeps its own pipe's other end, it never sees EOF when
+        # the master dies.
+        inherited = [conn, self._wake_recv, self._wake_send] + [
+            worker.conn for worker in self._workers if worker is not None and not worker.conn.closed
+        ]
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, inherited), name=f"analysis-{index}", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, conn)
+
+    def _replace(self, worker, reason):
+        worker.conn.close()
+        worker.process.join(5.0)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+        replacement = self._spawn(worker.index)
+        with self._lock:
+            self._workers[worker.index] = replacement
+        self.restarts += 1
+        get_metrics().inc("prefork_worker_restarts_total", reason=reason)
+        log_event(
+            "prefork_worker_replaced",
+            worker=worker.index,
+            reason=reason,
+            pid=worker.process.pid,
+            exitcode=worker.process.exitcode,
+            jobs=worker.jobs,
+        )
+
+    def _retire(self, worker, reason):
+        try:
+            worker.conn.send(None)
+        except OSError:
+            pass
+        self._replace(worker, reason)
+
+    def _crashed(self, worker):
+        worker.process.join(1.0)
+        if worker.job is not None:
+            future, _ = worker.job
+            future.set_exception(
+                WorkerCrashed(f"analysis worker exited with code {worker.process.exitcode}")
+            )
+        self._replace(worker, "crash")
+
+    def _assign(self):
+        for worker in self._workers:
+            if worker.job is not None:
+                continue
+            with self._lock:
+                if not self._queue:
+                    return
+                future, job = self._queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.conn.send(job)
+            except OSError:
+                # The worker died while idle; its sentinel is handled next.
+                with self._lock:
+                    self._queue.appendleft((future, job))
+                return
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            worker.job = (future, time.perf_counter())
+
+    def _collect(self, worker):
+        try:
+            ok, value, delta = worker.conn.recv()
+        except (EOFError, OSError):
+            self._crashed(worker)
+            return
+        future, sent = worker.job
+        worker.job = None
+        worker.jobs += 1
+        metrics = get_metrics()
+        metrics.merge(delta)
+        metrics.observe("prefork_job_seconds", time.perf_counter() - sent)
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            self._retire(worker, "max_jobs")
+        elif self.max_private and process_memory(worker.process.pid)["private"] > self.max_private:
+            self._retire(worker, "max_private")
+
+    def _report(self):
+        metrics = get_metrics()
+        stats = self.stats()
+        for worker in stats:
+            for field in ("rss", "pss", "private"):
+                metrics.set(f"prefork_worker_{field}_bytes", getattr(worker, field), worker=worker.index)
+        log_event("prefork_workers", workers=[worker._asdict() for worker in stats])
+
+    def _run(self):
+        try:
+            (self._registry or get_registry()).warm_up()
+            # Keep the collector from touching, and so copying, the shared objects.
+            gc.collect()
+            gc.freeze()
+            self._workers = [None] * self.workers
+            for index in range(self.workers):
+                self._workers[index] = self._spawn(index)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        log_event("prefork_started", workers=[worker.process.pid for worker in self._workers])
+
+        next_report = time.monotonic()
+        while not self._closing:
+            self._assign()
+            owners = {}
+            for worker in self._workers:
+                owners[worker.process.sentinel] = worker
+                if worker.job is not None:
+                    owners[worker.conn] = worker
+            ready = wait([self._wake_recv, *owners], max(0.0, next_report - time.monotonic()))
+            for item in ready:
+                if item is self._wake_recv:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv_bytes()
+                    continue
+                worker = owners[item]
+                if self._workers[worker.index] is not worker:
+                    continue
+                if item is worker.conn:
+                    self._collect(worker)
+                elif worker.job is None:
+                    # Died while idle; a running job is failed through its pipe instead.
+                    self._crashed(worker)
+            if time.monotonic() >= next_report:
+                self._report()
+                next_report = time.monotonic() + self.report_interval
+        self._shutdown()
+
+    def _shutdown(self):
+        with self._lock:
+            queued, self._queue = list(self._queue), collections.deque()
+        for future, _ in queued:
+            future.cancel()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            worker.process.join(5.0)
+            if worker.process.is_alive():
+                worker.process.kill()
+            if worker.job is not None:
+                worker.job[0].set_exception(WorkerCrashed("pool closed"))
+        log_event("prefork_stopped", restarts=self.restarts)
@@ -0,0 +1,64 @@
+"""
+Compare downscaled (pyramid) detection against native-resolution detection.
+
+Usage:
+    python -m faceRecModule.pyramid_compare photo1.jpg photo2.jpg --detect-size 640 1024
+"""
+import argparse
+import time
+
+import numpy as np
+
+from faceRecModule.faceFeature import FaceFeatures, NoFaceError
+from faceRecModule.models import get_registry
+
+
+def run(filepath, detect_size):
+    """
+    Time landmark detection on one image.
+
+    Returns:
+        tuple: (landmarks or None, seconds)
+    """
+    faceFeature = FaceFeatures(filepath, detect_size=detect_size)
+    start = time.perf_counter()
+    try:
+        points = faceFeature.find_face_features()
+    except NoFaceError:
+        points = None
+    return points, time.perf_counter() - start
+
+
+def landmark_error(reference, points):
+    """
+    Mean landmark distance normalised by the inter-ocular distance.
+    """
+    interocular = np.linalg.norm(reference[36] - reference[45])
+    return float(np.linalg.norm(reference - points, axis=1).mean() / interocular)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--detect-size", type=int, nargs="+", default=[640, 1024])
+    args = parser.parse_args()
+
+    get_registry().warm_up()
+    print(f"{'image':<30} {'mode':>8} {'ms':>9} {'speedup':>8} {'NME':>8}")
+    for filepath in args.images:
+        reference, native_time = run(filepath, None)
+        print(f"{filepath:<30} {'native':>8} {native_time * 1000:>9.1f} {1.0:>8.2f} {0.0:>8.4f}")
+        for detect_size in args.detect_size:
+            points, elapsed = run(filepath, detect_size)
+            if reference is None or points is None:
+                error = "missed" if reference is not None else "n/a"
+            else:
+                error = f"{landmark_error(reference, points):.4f}"
+            print(
+                f"{filepath:<30} {detect_size:>8} {elapsed * 1000:>9.1f} "
+                f"{native_time / elapsed:>8.2f} {error:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
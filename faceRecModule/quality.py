@@ -0,0 +1,276 @@
+"""
+Pre-flight image quality gate run before the full analysis pipeline.
+
+The checks run on a small downscaled copy, so a blurred, badly exposed,
+colour-cast or faceless upload is rejected in a few milliseconds instead
+of going through full-resolution landmarking and the palette requests.
+"""
+import math
+import os
+import time
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+from faceRecModule.decode import image_size, load_image
+from faceRecModule.models import get_registry
+from metrics import get_metrics
+
+
+class Thresholds(NamedTuple):
+    """
+    Limits applied by check_quality, calibrated for the default check size.
+    """
+
+    # Minimum variance of the Laplacian over the face (or whole image).
+    min_sharpness: float = 40.0
+    # Smallest 99th percentile of the image luminance, 0-255; below it nothing is well lit.
+    min_highlights: float = 60.0
+    # Largest share of blown-out face pixels (> 250).
+    max_blown: float = 0.1
+    # Largest share of clipped face pixels (< 8 or > 247).
+    max_clipped: float = 0.25
+    # Largest distance of the mean a*, b* of the near-neutral background
+    # pixels from neutral grey (OpenCV 8-bit LAB).
+    max_colour_cast: float = 25.0
+    # Smallest face height as a share of the image's shorter side. The check
+    # copy is made large enough for the detector to find a face this size.
+    min_face_fraction: float = 0.2
+    # Smallest face height in pixels of the original image.
+    min_face_pixels: int = 100
+
+
+class QualityIssue(NamedTuple):
+    """
+    One reason an image was rejected.
+    """
+
+    code: str
+    message: str
+    value: float
+    threshold: float
+
+
+class QualityReport(NamedTuple):
+    """
+    Outcome of check_quality.
+    """
+
+    issues: list
+    measurements: dict
+    faces: int
+    elapsed_ms: float
+    # (boxes, scores) from the detector, with the (left, top, right, bottom)
+    # boxes as fractions of the image width and height, so they apply at any
+    # decode size; see FaceFeatures.find_faces. None if the image was unreadable.
+    detections: tuple = None
+
+    @property
+    def ok(self):
+        return not self.issues
+
+
+class QualityError(ValueError):
+    """
+    Raised when an image fails the quality gate.
+    """
+
+    def __init__(self, report):
+        super().__init__("; ".join(issue.message for issue in report.issues))
+        self.report = report
+
+    def __reduce__(self):
+        # Rebuilt from the report, e.g. when sent back from a worker process.
+        return QualityError, (self.report,)
+
+
+# Direction names of a colour cast, by a*b* angle in 45-degree steps from +a.
+_CAST_NAMES = ("red", "orange", "yellow", "yellow-green", "green", "cyan", "blue", "magenta")
+
+# Messages shown for each reject reason.
+MESSAGES = {
+    "unreadable": "The file could not be read as an image.",
+    "no_face": "No face was found. Use a photo with one clear, front-facing face.",
+    "face_too_small": "The face is too small. Move closer or crop the photo around the face.",
+    "blurry": "The photo is blurry. Hold the camera still and focus on the face.",
+    "underexposed": "The photo is too dark. Take it in brighter light.",
+    "overexposed": "The photo is too bright. Avoid direct flash or strong sunlight.",
+    "clipped": "Parts of the face are blown out or crushed. Use softer, even light.",
+    "colour_cast": "The photo has a strong {direction} colour cast, which would skew the colours. Use neutral daylight.",
+}
+
+
+def _load_small(source, size, min_side=0):
+    """
+    Decode a copy whose longest side is at most size, using reduced JPEG decoding when possible.
+
+    The reduction is chosen from the header dimensions so the decoder never
+    produces a copy smaller than needed. The shorter side is kept at least
+    min_side where the original allows, even if the longest side then
+    exceeds size.
+
+    Returns:
+        tuple: (image, scale from original to small) or (None, None).
+    """
+    if isinstance(source, np.ndarray) and source.ndim > 1:
+        img, reduce = source, 1
+    else:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                source = f.read()
+        elif hasattr(source, "read"):
+            source = source.read()
+        dimensions = image_size(source)
+        reduce = 1
+        if dimensions is not None:
+            target = max(size / max(dimensions), min_side / min(dimensions))
+            reduce = max(
+                [factor for factor in (1, 2, 4, 8) if factor * target <= 1] or [1]
+            )
+        img = load_image(source, reduce=reduce)
+    if img is None:
+        return None, None
+    height, width = img.shape[:2]
+    scale = min(1.0, max(size / max(height, width), min_side / min(height, width)))
+    if scale < 1.0:
+        # After a reduced decode at most a 2x step is left, which bilinear
+        # handles without aliasing at a fraction of INTER_AREA's cost.
+        interpolation = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=interpolation)
+    return img, scale / reduce
+
+
+def _colour_cast(img, box, max_cast):
+    """
+    Mean a*, b* offset from grey of the near-neutral pixels around the face.
+
+    Skin is strongly coloured, so a grey-world average that includes the
+    face reads every skin tone as a cast. The face box, widened by half its
+    size on each side for the ears, hair and neck, is left out, and so are
+    clipped pixels and vivid surfaces (chroma over twice max_cast), which
+    say nothing about the light.
+
+    Returns:
+        tuple: (a offset, b offset), or None if too few pixels remain to judge.
+    """
+    # Every other pixel is plenty for a mean and quarters the LAB conversion.
+    lab = cv2.cvtColor(img[::2, ::2], cv2.COLOR_BGR2LAB)
+    keep = (lab[..., 0] > 20) & (lab[..., 0] < 235)
+    if box is not None:
+        left, top, right, bottom = np.asarray(box) // 2
+        margin_x, margin_y = (right - left) // 2, (bottom - top) // 2
+        keep[max(top - margin_y, 0):max(bottom + margin_y, 0), max(left - margin_x, 0):max(right + margin_x, 0)] = False
+    a = lab[..., 1].astype(np.int32) - 128
+    b = lab[..., 2].astype(np.int32) - 128
+    keep &= a * a + b * b < (2 * max_cast) ** 2
+    mask = keep.view(np.uint8)
+    if cv2.countNonZero(mask) < 0.05 * mask.size:
+        return None
+    _, mean_a, mean_b, _ = cv2.mean(lab, mask=mask)
+    return mean_a - 128, mean_b - 128
+
+
+def check_quality(source, registry=None, size=480, thresholds=Thresholds()):
+    """
+    Check sharpness, exposure, colour cast and face presence and size.
+
+    Sharpness and clipping are measured on the largest face when there is
+    one, since a blurred or dark background is fine. Exposure is judged
+    from the histogram rather than the mean, so very light and very deep
+    skin are not mistaken for bad exposure: an image is underexposed when
+    even its brightest pixels are dark, and overexposed when the face is
+    blown out. The colour cast is measured around the face, see
+    _colour_cast.
+
+    The face boxes are returned in the report, so an analysis that follows
+    the gate can skip detection by passing them to FaceFeatures.find_faces.
+
+    Args:
+        source (str | bytes | file | numpy.ndarray): The image, as accepted by load_image.
+        registry (ModelRegistry, optional): Registry holding the face detector.
+        size (int): Longest side of the copy the checks run on, unless the
+            detector's min_face needs a larger copy.
+        thresholds (Thresholds): Rejection limits.
+
+    Returns:
+        QualityReport: Issues found (empty if the image passes) and the measurements.
+    """
+    start = time.perf_counter()
+    metrics = get_metrics()
+    issues = []
+    with metrics.span("quality"):
+        detector = (registry or get_registry()).detector
+        # A face just at min_face_fraction must still be detectable, or it
+        # would be reported as missing rather than too small.
+        min_side = math.ceil(getattr(detector, "min_face", 0) / thresholds.min_face_fraction)
+        img, scale = _load_small(source, size, min_side)
+        if img is None:
+            issues.append(QualityIssue("unreadable", MESSAGES["unreadable"], 0.0, 0.0))
+            report = QualityReport(issues, {}, 0, (time.perf_counter() - start) * 1000)
+            metrics.inc("quality_rejected_total", reason="unreadable")
+            return report
+
+        boxes, scores = detector.detect(img)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        region = gray
+        box = None
+        face_height = 0
+        if len(boxes):
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            box = boxes[areas.argmax()]
+            left, top, right, bottom = box
+            face_height = bottom - top
+            face = gray[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+            if face.size:
+                region = face
+
+        sharpness = float(cv2.Laplacian(region, cv2.CV_64F).var())
+        histogram = np.bincount(gray.ravel(), minlength=256).cumsum()
+        highlights = float(np.searchsorted(histogram, 0.99 * histogram[-1]))
+        blown = float(np.count_nonzero(region > 250) / region.size)
+        clipped = float(np.count_nonzero((region < 8) | (region > 247)) / region.size)
+        offset = _colour_cast(img, box, thresholds.max_colour_cast)
+        cast_a, cast_b = (0.0, 0.0) if offset is None else offset
+        cast = float(np.hypot(cast_a, cast_b))
+        face_fraction = float(face_height / min(height, width))
+        face_pixels = face_height / scale
+
+        def reject(code, value, threshold, **details):
+            issues.append(QualityIssue(code, MESSAGES[code].format(**details), value, threshold))
+
+        if not len(boxes):
+            reject("no_face", 0.0, 1.0)
+        elif face_fraction < thresholds.min_face_fraction:
+            reject("face_too_small", round(face_fraction, 3), thresholds.min_face_fraction)
+        elif face_pixels < thresholds.min_face_pixels:
+            reject("face_too_small", int(face_pixels), thresholds.min_face_pixels)
+        if sharpness < thresholds.min_sharpness:
+            reject("blurry", round(sharpness, 1), thresholds.min_sharpness)
+        if highlights < thresholds.min_highlights:
+            reject("underexposed", highlights, thresholds.min_highlights)
+        elif blown > thresholds.max_blown:
+            reject("overexposed", round(blown, 3), thresholds.max_blown)
+        elif clipped > thresholds.max_clipped:
+            reject("clipped", round(clipped, 3), thresholds.max_clipped)
+        if cast > thresholds.max_colour_cast:
+            angle = np.degrees(np.arctan2(cast_b, cast_a))
+            direction = _CAST_NAMES[int(((angle + 22.5) % 360) // 45)]
+            reject("colour_cast", round(cast, 1), thresholds.max_colour_cast, direction=direction)
+
+    for issue in issues:
+        metrics.inc("quality_rejected_total", reason=issue.code)
+    measurements = {
+        "sharpness": round(sharpness, 1),
+        "highlights": highlights,
+        "blown": round(blown, 3),
+        "clipped": round(clipped, 3),
+        "colour_cast": None if offset is None else round(cast, 1),
+        "face_fraction": round(face_fraction, 3),
+        "face_pixels": int(face_pixels),
+    }
+    detections = (boxes / np.array([width, height, width, height], dtype=float), scores)
+    return QualityReport(
+        issues, measurements, len(boxes), (time.perf_counter() - start) * 1000, detections
+    )
@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+# Order in which feature colours are reported everywhere in the app.
+FEATURE_NAMES = ("left_eye", "right_eye", "nose", "jaw", "lips")
+
+# Landmark index pairs whose midpoint is sampled when a region is empty.
+FEATURE_LANDMARK_PAIRS = np.array(
+    [
+        [36, 42],
+        [45, 39],
+        [31, 35],
+        [0, 16],
+        [48, 54],
+    ]
+)
+
+# 68-point landmark polygons outlining each region, in FEATURE_NAMES order.
+REGION_POLYGONS = (
+    list(range(36, 42)),
+    list(range(42, 48)),
+    [27, 31, 32, 33, 34, 35],
+    list(range(3, 14)) + [35, 31],
+    list(range(48, 60)),
+)
+
+# Regions are painted in this order so later ones win where polygons overlap
+# (the nose and lips are cut out of the lower-face jaw polygon).
+_PAINT_ORDER = (3, 2, 4, 0, 1)
+
+# Pixels of the face box sampled at most by region_statistics; larger faces
+# are read on a regular grid, which leaves the medians practically unchanged.
+MAX_SAMPLES = 32 * 1024
+
+# Columns of the array returned by region_statistics.
+STAT_COLUMNS = ("b", "g", "r", "L", "a", "b*")
+
+
+def region_label_map(shape, points):
+    """
+    Rasterise the feature polygons into a single label image.
+
+    Args:
+        shape (tuple): (height, width) of the label image.
+        points (numpy.ndarray): (68, 2) landmarks in the label image's coordinates.
+
+    Returns:
+        numpy.ndarray: uint8 image where 0 is background and i + 1 marks FEATURE_NAMES[i].
+    """
+    labels = np.zeros(shape[:2], dtype=np.uint8)
+    points = np.asarray(points, dtype=np.int32)
+    for region in _PAINT_ORDER:
+        cv2.fillPoly(labels, [points[REGION_POLYGONS[region]]], region + 1)
+    return labels
+
+
+def region_statistics(img, points):
+    """
+    Median BGR and LAB colour of every facial region in one vectorized pass.
+
+    The face is cropped to the landmark bounding box and sampled on a grid
+    of at most MAX_SAMPLES pixels, every region is painted into one label
+    map, and the per-region medians of all six channels of the labelled
+    pixels come out of one histogram per channel, linear in the number of
+    pixels. A region too small to
+    contain any sampled pixel falls back to the landmark midpoint sample.
+
+    Args:
+        img (numpy.ndarray): BGR image.
+        points (numpy.ndarray): (68, 2) array of facial landmarks.
+
+    Returns:
+        numpy.ndarray: (5, 6) uint8 array, rows in FEATURE_NAMES order and
+            columns in STAT_COLUMNS order (OpenCV 8-bit LAB).
+    """
+    points = np.asarray(points)
+    height, width = img.shape[:2]
+    x0, y0 = np.clip(points.min(axis=0), 0, [width - 1, height - 1])
+    x1, y1 = np.clip(points.max(axis=0) + 1, 1, [width, height])
+
+    step = max(1, int(np.ceil(np.sqrt((x1 - x0) * (y1 - y0) / MAX_SAMPLES))))
+    roi = img[y0:y1, x0:x1]
+    if step > 1:
+        roi = cv2.resize(roi, None, fx=1 / step, fy=1 / step, interpolation=cv2.INTER_NEAREST)
+    labels = region_label_map(roi.shape, np.rint((points - [x0, y0]) / step)).ravel()
+
+    # Most of the box is background: only the labelled pixels are converted
+    # to LAB and counted, in one 256-bin histogram per region and channel
+    # (cv2.calcHist is several times faster than np.bincount here). Medians
+    # are read off the cumulative counts.
+    inside = np.flatnonzero(labels)
+    regions = len(FEATURE_NAMES)
+    if len(inside):
+        bgr = np.take(roi.reshape(-1, 3), inside, axis=0)[None]
+        lab = cv2.cvtColor(bgr, cv2.COLOR_BGR2LAB)
+        region = labels[inside][None]
+        histograms = np.stack(
+            [
+                cv2.calcHist([region, bgr, lab], [0, channel], None, [regions, 256], [1, regions + 1, 0, 256])
+                for channel in range(1, 7)
+            ],
+            axis=2,
+        ).astype(np.int32)
+    else:
+        histograms = np.zeros((regions, 256, 6), dtype=np.int32)
+    counts = histograms[:, :, 0].sum(axis=1)
+    below = np.cumsum(histograms, axis=1) <= (counts // 2)[:, None, None]
+    stats = below.sum(axis=1).astype(np.uint8)
+
+    empty = counts == 0
+    if empty.any():
+        fallback = points[FEATURE_LANDMARK_PAIRS[empty]].sum(axis=1) // 2
+        fallback = np.clip(fallback, 0, [width - 1, height - 1])
+        bgr = img[fallback[:, 1], fallback[:, 0]]
+        stats[empty, :3] = bgr
+        stats[empty, 3:] = cv2.cvtColor(bgr[None], cv2.COLOR_BGR2LAB)[0]
+    return stats
+
+
+def bgr_to_hex(colours):
+    """
+    Convert BGR rows to hexadecimal color codes.
+
+    Args:
+        colours (numpy.ndarray): (N, 3) array of BGR colours.
+
+    Returns:
+        tuple: Hexadecimal color codes.
+    """
+    return tuple("#{:02x}{:02x}{:02x}".format(r, g, b) for b, g, r in colours)
@@ -0,0 +1,152 @@
+"""
+Live colour analysis of a video file or camera feed.
+
+Usage:
+    python -m faceRecModule.video 0            # default webcam
+    python -m faceRecModule.video clip.mp4 --detect-every 15
+"""
+import argparse
+import time
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from faceRecModule.faceFeature import FaceFeatures
+from faceRecModule.models import get_registry
+from faceRecModule.regions import FEATURE_NAMES, bgr_to_hex, region_statistics
+
+_LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+class FrameResult(NamedTuple):
+    """
+    Analysis of one video frame.
+    """
+
+    index: int
+    landmarks: Optional[np.ndarray]
+    stats: Optional[np.ndarray]
+    detected: bool
+    detect_ms: float
+    track_ms: float
+
+
+def analyse_video(
+    source,
+    detect_every=10,
+    min_tracked=0.8,
+    smoothing=0.3,
+    detect_size=640,
+    registry=None,
+):
+    """
+    Yield landmarks and smoothed region colours for every frame of a video.
+
+    The full face detector runs only every detect_every frames or when
+    tracking is lost; in between, the previous landmarks are carried forward
+    with pyramidal Lucas-Kanade optical flow.
+
+    Args:
+        source (str | int): Video file path, stream URL or camera index.
+        detect_every (int): Frames between full detections.
+        min_tracked (float): Fraction of landmarks that must be tracked for
+            the track to be kept.
+        smoothing (float): Weight of the newest frame in the exponential
+            moving average of region colours; 1 disables smoothing.
+        detect_size (int, optional): Longest side used for face detection.
+        registry (ModelRegistry, optional): Registry holding the loaded models.
+
+    Yields:
+        FrameResult: Per-frame landmarks, (5, 6) smoothed region statistics
+            and the time spent detecting and tracking.
+    """
+    registry = (registry or get_registry()).warm_up()
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"could not open video source {source!r}")
+
+    points = None
+    prev_gray = None
+    smoothed = None
+    since_detect = 0
+    index = 0
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            detect_ms = track_ms = 0.0
+            detected = False
+
+            if points is not None and since_detect < detect_every:
+                start = time.perf_counter()
+                new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                    prev_gray, gray, points.reshape(-1, 1, 2), None, **_LK_PARAMS
+                )
+                track_ms = (time.perf_counter() - start) * 1000
+                if status.mean() >= min_tracked:
+                    points = new_points.reshape(-1, 2)
+                else:
+                    points = None
+
+            if points is None or since_detect >= detect_every:
+                start = time.perf_counter()
+                faces = FaceFeatures(frame, registry=registry, detect_size=detect_size).find_faces("largest")
+                detect_ms = (time.perf_counter() - start) * 1000
+                points = faces[0].landmarks.astype(np.float32) if faces else None
+                detected = True
+                since_detect = 0
+            since_detect += 1
+            prev_gray = gray
+
+            if points is None:
+                smoothed = None
+                yield FrameResult(index, None, None, detected, detect_ms, track_ms)
+            else:
+                landmarks = np.rint(points).astype(np.int32)
+                stats = region_statistics(frame, landmarks).astype(np.float32)
+                smoothed = stats if smoothed is None else smoothing * stats + (1 - smoothing) * smoothed
+                yield FrameResult(
+                    index, landmarks, np.rint(smoothed).astype(np.uint8), detected, detect_ms, track_ms
+                )
+            index += 1
+    finally:
+        capture.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source")
+    parser.add_argument("--detect-every", type=int, default=10)
+    parser.add_argument("--detect-size", type=int, default=640)
+    args = parser.parse_args()
+    source = int(args.source) if args.source.isdigit() else args.source
+
+    frames = detections = 0
+    detect_ms = track_ms = 0.0
+    start = time.perf_counter()
+    for result in analyse_video(source, args.detect_every, detect_size=args.detect_size):
+        frames += 1
+        detections += result.detected
+        detect_ms += result.detect_ms
+        track_ms += result.track_ms
+        if result.stats is not None and result.index % 30 == 0:
+            print(result.index, dict(zip(FEATURE_NAMES, bgr_to_hex(result.stats[:, :3]))))
+
+    elapsed = time.perf_counter() - start
+    tracked = max(frames - detections, 1)
+    print(
+        f"{frames} frames at {frames / elapsed:.1f} fps; "
+        f"detect {detect_ms / max(detections, 1):.1f} ms x {detections}, "
+        f"track {track_ms / tracked:.2f} ms x {frames - detections}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+from faceRecModule.cache import content_key
+
+
+class ImageStore:
+    """
+    In-memory, size-capped store of uploaded image bytes.
+
+    Images are keyed by the SHA-1 of their content. When the total size
+    exceeds max_bytes, the least recently used images are evicted.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): Upper bound on the total size of stored images.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def put(self, data: bytes):
+        """
+        Store image bytes, evicting older images if needed.
+
+        Args:
+            data (bytes): Encoded image.
+
+        Returns:
+            str: Content key of the image.
+
+        Raises:
+            ValueError: If the image alone is larger than max_bytes.
+        """
+        if len(data) > self.max_bytes:
+            raise ValueError(
+                f"image of {len(data)} bytes exceeds the {self.max_bytes} byte store limit"
+            )
+        key = content_key(data)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return key
+            self._images[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.size -= len(evicted)
+        return key
+
+    def get(self, key):
+        """
+        Return the bytes stored under key, or None if missing or evicted.
+        """
+        with self._lock:
+            data = self._images.get(key)
+            if data is not None:
+                self._images.move_to_end(key)
+            return data
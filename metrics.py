@@ -0,0 +1,241 @@
+"""
+Low-overhead timing spans, counters and exporters for the analysis and LLM pipelines.
+"""
+import bisect
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+logger = logging.getLogger("photogpt.metrics")
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and latency histograms.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = collections.defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Add value to a counter.
+        """
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge to value.
+        """
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Record one latency sample in a histogram.
+        """
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """
+        Time a block into the stage_seconds histogram.
+
+        Yields:
+            dict: Mutable labels; keys added inside the block are recorded too.
+        """
+        labels = dict(labels, stage=stage)
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["status"] = "error"
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, **labels)
+
+    def drain(self):
+        """
+        Take the counters and histograms recorded since the last drain, leaving them empty.
+
+        Returns:
+            dict: Deltas to pass to merge, e.g. in another process.
+        """
+        with self._lock:
+            delta = {"counters": dict(self._counters), "histograms": self._histograms}
+            self._counters = collections.defaultdict(float)
+            self._histograms = {}
+        return delta
+
+    def merge(self, delta):
+        """
+        Add counters and histograms taken with drain from another registry with the same buckets.
+        """
+        with self._lock:
+            for key, value in delta["counters"].items():
+                self._counters[key] += value
+            for key, (counts, total, count) in delta["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * len(counts), 0.0, 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def prometheus_text(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, key), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f"# TYPE {name} gauge")
+            for (metric, key), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, key), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    le_key = key + (("le", bound),)
+                    lines.append(f"{name}_bucket{_format_labels(le_key)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Counters and histogram totals as plain data, e.g. for JSON logs.
+        """
+        with self._lock:
+            return {
+                "counters": {
+                    name + _format_labels(key): value for (name, key), value in self._counters.items()
+                },
+                "gauges": {
+                    name + _format_labels(key): value for (name, key), value in self._gauges.items()
+                },
+                "histograms": {
+                    name + _format_labels(key): {"count": h[2], "sum": h[1]}
+                    for (name, key), h in self._histograms.items()
+                },
+            }
+
+
+def log_event(event: str, **fields):
+    """
+    Emit one structured JSON log line on the photogpt.metrics logger.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, "ts": time.time(), **fields}, default=str))
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler that reports where a slow block spent its time.
+
+    While the block runs, a background thread samples the calling thread's
+    stack every interval seconds. If the block takes longer than threshold,
+    the most frequent stacks are logged; otherwise the samples are dropped.
+    """
+
+    def __init__(self, name: str, threshold: float = 1.0, interval: float = 0.005, top: int = 5):
+        self.name = name
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame, limit=8)
+                self.samples[tuple(f"{f.filename}:{f.lineno}:{f.name}" for f in stack)] += 1
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        elapsed = time.perf_counter() - self._start
+        if elapsed >= self.threshold:
+            total = sum(self.samples.values()) or 1
+            log_event(
+                "slow_request",
+                name=self.name,
+                seconds=round(elapsed, 4),
+                top_stacks=[
+                    {"share": round(count / total, 3), "stack": list(stack)}
+                    for stack, count in self.samples.most_common(self.top)
+                ],
+            )
+        return False
+
+
+_metrics = Metrics()
+# A forked worker starts with empty metrics and a fresh lock, which another
+# thread of the parent may have held at the moment of the fork.
+os.register_at_fork(after_in_child=lambda: _metrics.__init__(_metrics.buckets))
+
+
+def get_metrics():
+    """
+    Return the process-wide metrics registry.
+    """
+    return _metrics
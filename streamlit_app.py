@@ -1,16 +1,67 @@
 import streamlit as st
-import uuid
-from chat_llm.chat_handler import hexcode_from_text, hexcode_remover_from_text, ChatHandler
-from faceRecModule.faceFeature import FaceFeatures
+from chat_llm.chat_handler import ChatHandler
+from openai import OpenAI
+from chat_llm.palette_cache import PaletteCache
+from chat_llm.harmony import get_engine
+from chat_llm.scheduler import RateLimitScheduler
+from chat_llm.palettes import PALETTE_KINDS, PaletteEntry, format_palette, parse_palette_text
+from faceRecModule.cache import AnalysisCache, analyse_cached
+from faceRecModule.faceFeature import NoFaceError
+from faceRecModule.quality import QualityError
+from faceRecModule.models import get_registry
+from faceRecModule.regions import FEATURE_NAMES, bgr_to_hex
+from image_store import ImageStore
+from metrics import log_event
 from dotenv import load_dotenv
+import httpx
 import os
-import multiprocessing as mp
-import time
 load_dotenv(".env")
 api_key = os.getenv("OPENAI_API_KEY")
+# Longest side used for face detection; larger uploads are downscaled first.
+DETECT_SIZE = 1024
+# Uploads larger than this are decoded at half resolution.
+REDUCED_DECODE_BYTES = 6 * 1024 * 1024
+# Per-session cap on the memory used by uploaded images.
+SESSION_IMAGE_BYTES = 32 * 1024 * 1024
+# Deadline in seconds for each palette completion.
+LLM_TIMEOUT = 60
+# Shown in place of a palette the AI could not answer, and above a local fallback.
+PALETTE_FAILED = "The AI could not answer this one. Use the retry button below."
+PALETTE_FALLBACK = "The AI could not answer this one, so these colours were matched locally."
+# When set, face analysis and palettes are done by the backend service instead of in-process.
+BACKEND_URL = os.getenv("BACKEND_URL")
 
 st.set_page_config(page_title="PhotoGPT", page_icon="thumbnail.png", layout="centered", initial_sidebar_state="auto", menu_items=None)
 
+@st.cache_resource
+def load_models():
+    return get_registry().warm_up()
+
+
+@st.cache_resource
+def load_analysis_cache():
+    return AnalysisCache(path=".cache/analysis.sqlite")
+
+
+@st.cache_resource
+def load_openai_client():
+    return OpenAI(api_key=api_key)
+
+
+@st.cache_resource
+def load_palette_cache():
+    return PaletteCache(path=".cache/palettes.sqlite")
+
+
+@st.cache_resource
+def load_scheduler():
+    # Shared by all sessions so concurrent users stay within one account quota.
+    return RateLimitScheduler()
+
+
+if not BACKEND_URL:
+    load_models()
+
 st.markdown("""
         <style>
                .block-container {
@@ -23,22 +74,148 @@ st.markdown("""
         """, unsafe_allow_html=True)
 
 
-def get_hexcodes(filepath:str):
+def get_hexcodes_from_backend(image:bytes):
+    response = httpx.post(f"{BACKEND_URL}/analyze", files={"image": image}, timeout=60)
+    if response.status_code == 422:
+        detail = response.json()["detail"]
+        if isinstance(detail, dict) and detail.get("error") == "quality":
+            return {"error": " ".join(issue["message"] for issue in detail["issues"])}
+        return {"error": "No face was found. Use a photo with one clear, front-facing face."}
+    response.raise_for_status()
+    colours = response.json()["colours"]
+    return {f"{name}_colour": colours[name]["hex"] for name in FEATURE_NAMES}
+
+
+def stream_palettes_from_backend(hexcodes):
+    # Yields (kind, entry, error) like ChatHandler.stream_palettes; the
+    # backend answers every kind in one response.
+    response = httpx.post(
+        f"{BACKEND_URL}/palettes", json={"hexcodes": list(hexcodes)}, timeout=LLM_TIMEOUT + 10
+    )
+    response.raise_for_status()
+    for palette in response.json()["palettes"]:
+        if palette["error"] is not None:
+            yield palette["kind"], None, palette["error"]
+            continue
+        for entry in palette["entries"]:
+            yield palette["kind"], PaletteEntry(int(entry["hex"][1:], 16), entry["name"], entry["rationale"]), None
+
+
+def get_hexcodes(image:bytes):
     try:
-        faceFeature = FaceFeatures(filepath)
-        points = faceFeature.find_face_features()
-        faceFeature.get_features_colour(points)
+        if BACKEND_URL:
+            return get_hexcodes_from_backend(image)
+        reduce = 2 if len(image) > REDUCED_DECODE_BYTES else 1
+        _, stats = analyse_cached(
+            image, load_analysis_cache(), gate=True, detect_size=DETECT_SIZE, reduce=reduce
+        )
+        hexcodes = bgr_to_hex(stats[:, :3])
         hexcode_face = {
-            "left_eye_colour": faceFeature.left_eye_colour,
-            "right_eye_colour": faceFeature.right_eye_colour,
-            "nose_colour": faceFeature.nose_colour,
-            "jaw_colour": faceFeature.jaw_colour,
-            "lips_colour": faceFeature.lips_colour
+            "left_eye_colour": hexcodes[0],
+            "right_eye_colour": hexcodes[1],
+            "nose_colour": hexcodes[2],
+            "jaw_colour": hexcodes[3],
+            "lips_colour": hexcodes[4]
         }
         return hexcode_face
-    
+
+    except QualityError as e:
+        return {"error": " ".join(issue.message for issue in e.report.issues)}
+    except NoFaceError:
+        return {"error": "No face was found. Use a photo with one clear, front-facing face."}
     except Exception as e:
-        return {"error": "Face feature extraction failed."}
+        log_event("analysis_error", error=repr(e))
+        return {"error": "Face feature extraction failed. Please try again."}
+
+
+def render_palette_entry(index, entry, key):
+    col1, col2 = st.columns([4,1])
+    with col1:
+        st.write(f"{index}. {entry.rationale}")
+    with col2:
+        st.color_picker(entry.name, entry.hex, key=key)
+
+
+def palette_stream(kinds):
+    # (kind, entry, error) for the given kinds of the current image's palettes.
+    hexcodes = tuple(st.session_state.features[f"{feature}_colour"] for feature in FEATURE_NAMES)
+    if BACKEND_URL:
+        return (item for item in stream_palettes_from_backend(hexcodes) if item[0] in kinds)
+    try:
+        llm_reply = ChatHandler(
+            api_key=api_key,
+            hexcodes=hexcodes,
+            cache=load_palette_cache(),
+            client=load_openai_client(),
+            scheduler=load_scheduler(),
+            harmony=get_engine(),
+        )
+    except Exception:
+        st.error("Something went wrong. Please try again.")
+        st.session_state.file_container = True
+        st.stop()
+    return llm_reply.stream_palettes(timeout=LLM_TIMEOUT, kinds=kinds)
+
+
+def collect_palettes(palette_stream, placeholders):
+    # Renders entries into each kind's placeholder as they stream; returns
+    # (entries per kind, kinds that failed or fell back to local colours).
+    containers = {kind: placeholder.container() for kind, placeholder in placeholders.items()}
+    entries = {kind: [] for kind in placeholders}
+    failed = set()
+    fallback = set()
+    with st.spinner("Please wait while the AI generates the best color palettes for you..."):
+        try:
+            for kind, entry, error in palette_stream:
+                if error is not None and kind not in fallback:
+                    log_event("palette_error", kind=kind, error=error)
+                    failed.add(kind)
+                    if entry is None:
+                        containers[kind].error(PALETTE_FAILED)
+                        continue
+                    # Local entries carrying the error replace the whole palette.
+                    fallback.add(kind)
+                    entries[kind] = []
+                    containers[kind] = placeholders[kind].container()
+                    containers[kind].info(PALETTE_FALLBACK)
+                entries[kind].append(entry)
+                prefix = "fallback" if kind in fallback else "live"
+                with containers[kind]:
+                    render_palette_entry(len(entries[kind]), entry, key=f"{prefix}-{kind}-{len(entries[kind])}")
+        except httpx.HTTPError as e:
+            log_event("palette_error", kind=None, error=repr(e))
+            for kind in placeholders:
+                if not entries[kind]:
+                    failed.add(kind)
+                    containers[kind].error(PALETTE_FAILED)
+    return entries, failed
+
+
+def palette_message(kind, entries, failed):
+    message = {
+        "role": "assistant",
+        "content": format_palette(entries) if entries else PALETTE_FAILED,
+        "entries": entries,
+        "kind": kind,
+        "image_key": st.session_state.image_key,
+    }
+    if failed and entries:
+        message["note"] = PALETTE_FALLBACK
+    return message
+
+
+def render_assistant_message(message, message_index):
+    # Entries are parsed once when the message is stored; older messages
+    # without them are parsed on first render and keep the result.
+    if "entries" not in message:
+        message["entries"] = parse_palette_text(message["content"])
+    if "note" in message:
+        st.info(message["note"])
+    if not message["entries"]:
+        st.write(message["content"])
+        return
+    for i, entry in enumerate(message["entries"]):
+        render_palette_entry(i + 1, entry, key=f"message-{message_index}-{i}")
     
 
 st.markdown(
@@ -102,6 +279,10 @@ if 'messages' not in st.session_state:
         "What are the best blush colours for me?",    
     ]
     st.session_state.file_container = True
+    st.session_state.image_store = ImageStore(max_bytes=SESSION_IMAGE_BYTES)
+    st.session_state.image_key = None
+    # Palette entries per analysed image, so reruns never call the API again.
+    st.session_state.palettes = {}
 
 
 if st.session_state.file_container:
@@ -114,42 +295,32 @@ if st.session_state.file_container:
             if uploaded_file is None:
                 st.warning("Please upload an image.")
             else:
-                with open("uploads/image.jpg","wb") as f:
-                    f.write(uploaded_file.read())
-                    with st.spinner("Processing..."):
-                        st.session_state.features = get_hexcodes("uploads/image.jpg")
-                        st.warning("Face feature extraction failed. Please try again.")
-                        st.session_state.file_container = True
-                        print(st.session_state.features)
-                        st.session_state.response_code = 200
-                        st.session_state.file_container = False
-                    st.success("Image uploaded successfully.")
+                image = uploaded_file.getvalue()
+                try:
+                    st.session_state.image_key = st.session_state.image_store.put(image)
+                except ValueError:
+                    st.warning("The image is too large. Please upload a smaller image.")
+                    st.stop()
+                with st.spinner("Processing..."):
+                    st.session_state.features = get_hexcodes(image)
+                    log_event("analysis", image_key=st.session_state.image_key, features=st.session_state.features)
+                    if "error" in st.session_state.features:
+                        st.warning(st.session_state.features["error"])
+                        st.stop()
+                    st.session_state.response_code = 200
+                    st.session_state.file_container = False
+                st.success("Image uploaded successfully.")
 
 
     
 if st.session_state.response_code == 200 and not st.session_state.file_container:
-    st.button(":blue[Upload another image]", on_click=lambda: st.session_state.update(file_container=True),key=f"{uuid.uuid4()}") 
-    llm_reply = None
-    try:
-        llm_reply = ChatHandler(
-            api_key=api_key,
-            hexcodes=(
-                st.session_state.features["left_eye_colour"],
-                st.session_state.features["right_eye_colour"],
-                st.session_state.features["nose_colour"],
-                st.session_state.features["jaw_colour"],
-                st.session_state.features["lips_colour"],
-            ),
-        )
-    except:
-        st.error("Something went wrong. Please try again.")
-        st.session_state.file_container = True
-        st.stop()
-
+    st.button(":blue[Upload another image]", on_click=lambda: st.session_state.update(file_container=True),key="upload_another")
     col1, col2 = st.columns([2,1])
     with col1:
         st.subheader("Uploaded Image")
-        st.image("uploads/image.jpg",width=300)
+        image = st.session_state.image_store.get(st.session_state.image_key)
+        if image is not None:
+            st.image(image,width=300)
     with col2:
         st.subheader("Face Features")
         st.color_picker("Left Eye",st.session_state.features["left_eye_colour"])
@@ -158,73 +329,45 @@ if st.session_state.response_code == 200 and not st.session_state.file_container
         st.color_picker("Jaw: ",st.session_state.features["jaw_colour"])
         st.color_picker("Lips: ",st.session_state.features["lips_colour"])
 
-    for message in st.session_state.messages:
+    for message_index, message in enumerate(st.session_state.messages):
         if message["role"] == "user":
             with st.chat_message("user"):
                 st.write(message["content"])
         else:
-            color_hexcode = hexcode_from_text(message["content"])
-            response = hexcode_remover_from_text(message["content"])
-            response = response[4:]
             with st.chat_message("assistant"):
-                for i in range(5):
-                    col1, col2 = st.columns([4,1])
-                    with col1:
-                        new_line_index = response.find("\n")
-                        if new_line_index != -1:
-                            st.write(f"{i+1}."+response[:new_line_index])
-                            response = response[new_line_index+6:]
-                        else:
-                            st.write(f"{i+1}."+response)
-                    with col2:
-                        st.color_picker( color_hexcode[i][1],f"#{color_hexcode[i][0]}",key=f"{uuid.uuid4()}")
-    with st.spinner("Please wait while the AI generates the best color palettes for you..."):
-        q = mp.Queue()
-        p1 = mp.Process(target=llm_reply.get_good_palette,kwargs={"queue":q})
-        p2 = mp.Process(target=llm_reply.get_bad_palette,kwargs={"queue":q})
-        p3 = mp.Process(target=llm_reply.get_blush,kwargs={"queue":q})
-
-        p1.start()
-        p2.start()
-        p3.start()
-
-        p1.join()
-        p2.join()
-        p3.join()
-    response_llm = [q.get() for _ in range(3)]
-    response_llm.sort(key = lambda x: x[1])
-    for i in range(len(st.session_state.prompt)):
-
-        prompt = st.session_state.prompt[i]
-        if prompt:
-            st.session_state.messages.append({"role":"user","content":prompt})
+                render_assistant_message(message, message_index)
+
+    image_key = st.session_state.image_key
+    if image_key not in st.session_state.palettes:
+        assistant_messages = {}
+        for prompt, kind in zip(st.session_state.prompt, PALETTE_KINDS):
             with st.chat_message("user"):
                 st.write(prompt)
-            with st.spinner("lets see what the AI has to say..."):
-                if prompt == st.session_state.prompt[0]:
-                    response = response_llm[0][0] 
-                elif prompt == st.session_state.prompt[1]:
-                    response = response_llm[1][0]
-                elif prompt == st.session_state.prompt[2]:
-                    response = response_llm[2][0]
-            
-                st.session_state.messages.append({"role":"assistant","content":response})
-                color_hexcode = hexcode_from_text(response)
-                response = hexcode_remover_from_text(response)[4:]
-                with st.chat_message("assistant"):
-                    for i in range(5):
-                        col1, col2 = st.columns([4,1])
-                        with col1:
-                            new_line_index = response.find("\n")
-                            if new_line_index != -1:
-                                st.write(f"{i+1}."+response[:new_line_index])
-                                response = response[new_line_index+6:]
-                            else:
-                                st.write(f"{i+1}."+response)
-                        with col2:
-                                st.color_picker( color_hexcode[i][1],f"#{color_hexcode[i][0]}",key=f"{uuid.uuid4()}")
-
-        
+            # A placeholder, so a local fallback can replace a half-streamed answer.
+            assistant_messages[kind] = st.chat_message("assistant").empty()
+        entries, failed = collect_palettes(palette_stream(PALETTE_KINDS), assistant_messages)
+        for prompt, kind in zip(st.session_state.prompt, PALETTE_KINDS):
+            st.session_state.messages.append({"role":"user","content":prompt})
+            st.session_state.messages.append(palette_message(kind, entries[kind], kind in failed))
+        # Stored even when some kinds failed, so reruns (a colour-picker
+        # click) never call the API or append the messages again.
+        st.session_state.palettes[image_key] = {"entries": entries, "failed": failed}
+
+    failed = st.session_state.palettes[image_key]["failed"]
+    if failed and st.button(":blue[Retry the palettes the AI could not answer]", key=f"retry-{image_key}"):
+        assistant_messages = {kind: st.chat_message("assistant").empty() for kind in PALETTE_KINDS if kind in failed}
+        retried, still_failed = collect_palettes(palette_stream(tuple(assistant_messages)), assistant_messages)
+        stored = st.session_state.palettes[image_key]
+        for kind in assistant_messages:
+            stored["entries"][kind] = retried[kind]
+        stored["failed"] = still_failed
+        # Replace the earlier answers in place instead of appending new ones.
+        for index, message in enumerate(st.session_state.messages):
+            if message.get("image_key") == image_key and message.get("kind") in assistant_messages:
+                kind = message["kind"]
+                st.session_state.messages[index] = palette_message(kind, retried[kind], kind in still_failed)
+        st.rerun()
+
 else:
     st.warning("Please upload an image to get started.")
 
@@ -1,48 +1,238 @@
-import openai
-
-
-def get_ai_response(question, doc, prompt, summary):
-    global prompt_template
-    prompt_template = prompt_template.format(document_data=doc, summary=summary)
-    prompt = [{}]
-    prompt[0] = {"role": "system", "content": prompt_template}
-
-    # Add the question the user question
-    prompt.append({"role": "user", "content": question})
-    prompt.append(
-        {
-            "role": "system",
-            "content": """create a summary for whole conversation and write it format 
-                    The format for summary is given as following:
-    #               <summary>Your generated summary here<summary>
-         """,
-        }
-    )
-    # prompt.append({
-    #      'role' : 'system',
-    #      'content' : """
-    #             Also summarize the input message and ai response with the previously provided summary keeping all important point and information,
-    #         keeping the summary in 4 to 5 lines.
-
-    #         The format for summary is given as following:
-    #         <summary>Your generated summary here<summary>
-    #         """
-
-    # })
-    response = []
-    result = ""
-    # Ask the question and stream the response
-    for chunk in openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-16k", messages=prompt, stream=True
-    ):
-        text = chunk.choices[0].get("delta", {}).get("content")
-        if text is not None:
-
-            response.append(text)
-
-    result = "".join(response).strip()
-    print("result --")
-    # When we get an answer back we add that to the message history
-    prompt.append({"role": "assistant", "content": result})
+"""
+Question answering over a document with bounded conversation memory.
+
+Each session keeps a ConversationMemory: a rolling summary plus the last
+few turns verbatim. Every reply ends with an updated <summary> block,
+which is split off the stream and replaces the previous summary, so older
+turns are folded in incrementally and the prompt stays about the same
+size from the fourth turn on.
+"""
+import re
+
+from openai import OpenAI
+
+from metrics import get_metrics, log_event
+
+MODEL = "gpt-3.5-turbo-16k"
+
+PROMPT_TEMPLATE = """You are a helpful assistant answering questions about the document below.
+
+Document:
+{document_data}
+
+Summary of the conversation so far:
+{summary}
+
+Answer the user's question. Then, on a new line, write an updated summary of
+the whole conversation, including this question and your answer, keeping all
+important points in at most {summary_tokens} tokens, in this format:
+<summary>Your updated summary here</summary>"""
+
+# Turns kept while replies come back without a summary block.
+_UNSUMMARISED_TURNS = 20
+
+_SUMMARY_OPEN = "<summary>"
+_SUMMARY_RE = re.compile(r"<summary>(.*?)(?:</summary>|<summary>|$)", re.DOTALL)
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+
+def count_tokens(text: str):
+    """
+    Count tokens locally, with tiktoken when installed and about four characters per token otherwise.
+
+    Parameters:
+        text (str): Text to count.
+
+    Returns:
+        int: Number of tokens.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, limit: int):
+    """
+    Cut text to at most limit tokens.
+    """
+    if count_tokens(text) <= limit:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:limit])
+    return text[: limit * 4]
+
+
+class SummaryStreamSplitter:
+    """
+    Separates the answer from the trailing <summary> block of a streamed reply.
 
+    Text is released as soon as it cannot be the start of the summary tag,
+    so the answer streams without the summary ever being shown.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._released = 0
+        self._in_summary = False
+
+    def feed(self, delta: str):
+        """
+        Adds a text delta.
+
+        Returns:
+            str: Answer text that can be shown now.
+        """
+        self.text += delta
+        if self._in_summary:
+            return ""
+        start = self.text.find(_SUMMARY_OPEN, self._released)
+        if start >= 0:
+            self._in_summary = True
+            end = start
+        else:
+            # Hold back a suffix that could be the beginning of the tag.
+            end = len(self.text)
+            for size in range(min(len(_SUMMARY_OPEN) - 1, len(self.text)), 0, -1):
+                if _SUMMARY_OPEN.startswith(self.text[-size:]):
+                    end -= size
+                    break
+        released, self._released = self.text[self._released:end], max(end, self._released)
+        return released
+
+    def close(self):
+        """
+        Flushes held-back text.
+
+        Returns:
+            tuple: (remaining answer text, summary or None).
+        """
+        match = _SUMMARY_RE.search(self.text)
+        if match is None:
+            rest, self._released = self.text[self._released:], len(self.text)
+            return rest, None
+        rest = self.text[self._released:match.start()]
+        self._released = len(self.text)
+        return rest, match.group(1).strip() or None
+
+    @property
+    def answer(self):
+        """
+        The full reply without the summary block.
+        """
+        match = _SUMMARY_RE.search(self.text)
+        return (self.text if match is None else self.text[: match.start()]).strip()
+
+
+class ConversationMemory:
+    """
+    Per-session conversation state under a fixed prompt token budget.
+
+    The prompt is the document (capped at document_tokens), the rolling
+    summary and the last max_turns turns, as far as they fit in the rest of
+    max_prompt_tokens. Older turns are dropped once a reply has refreshed
+    the summary, which then covers them; the window is only kept small so
+    the prompt stays flat instead of filling up the whole budget.
+    """
+
+    def __init__(self, max_prompt_tokens=6000, document_tokens=3000, summary_tokens=300, max_turns=3):
+        """
+        Parameters:
+            max_prompt_tokens (int): Budget for everything sent in one turn.
+            document_tokens (int): Share of the budget for the document.
+            summary_tokens (int): Length asked of the rolling summary.
+            max_turns (int): Recent turns kept verbatim next to the summary.
+        """
+        self.max_prompt_tokens = max_prompt_tokens
+        self.document_tokens = document_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turns = max_turns
+        self.summary = ""
+        self.turns = []
+
+    def messages(self, question: str, document: str):
+        """
+        Build the chat messages for the next turn within the token budget.
+
+        Parameters:
+            question (str): The user's question.
+            document (str): The document being discussed.
+
+        Returns:
+            tuple: (messages, prompt token count).
+        """
+        system = PROMPT_TEMPLATE.format(
+            document_data=truncate_tokens(document, self.document_tokens),
+            summary=self.summary or "(none yet)",
+            summary_tokens=self.summary_tokens,
+        )
+        used = count_tokens(system) + count_tokens(question)
+        history = []
+        for turn_question, answer, tokens in reversed(self.turns):
+            if used + tokens > self.max_prompt_tokens:
+                break
+            used += tokens
+            history[:0] = [
+                {"role": "user", "content": turn_question},
+                {"role": "assistant", "content": answer},
+            ]
+        messages = [{"role": "system", "content": system}] + history
+        messages.append({"role": "user", "content": question})
+        return messages, used
+
+    def add_turn(self, question: str, answer: str, summary=None):
+        """
+        Record a finished turn and, if the reply had one, the refreshed summary.
+        """
+        self.turns.append((question, answer, count_tokens(question) + count_tokens(answer)))
+        # Without a new summary the older turns are not covered yet; keep
+        # them until a reply summarises them, within the token budget.
+        if summary:
+            self.summary = truncate_tokens(summary, self.summary_tokens * 2)
+            del self.turns[: -self.max_turns]
+        else:
+            del self.turns[: -_UNSUMMARISED_TURNS]
+
+
+def get_ai_response(question, doc, memory, client=None, on_text=None):
+    """
+    Answer a question about a document, streaming the reply and updating memory.
+
+    Parameters:
+        question (str): The user's question.
+        doc (str): The document text.
+        memory (ConversationMemory): State of this session's conversation.
+        client (OpenAI, optional): Client to use; one is created if not given.
+        on_text (callable, optional): Called with each piece of answer text as it streams.
+
+    Returns:
+        str: The answer, without the summary block.
+    """
+    client = client or OpenAI()
+    messages, prompt_tokens = memory.messages(question, doc)
+    splitter = SummaryStreamSplitter()
+    stream = client.chat.completions.create(model=MODEL, messages=messages, stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            text = splitter.feed(chunk.choices[0].delta.content)
+            if text and on_text is not None:
+                on_text(text)
+    rest, summary = splitter.close()
+    if rest and on_text is not None:
+        on_text(rest)
+
+    result = splitter.answer
+    memory.add_turn(question, result, summary)
+    get_metrics().inc("conversation_prompt_tokens_total", prompt_tokens)
+    log_event(
+        "conversation_turn",
+        prompt_tokens=prompt_tokens,
+        turns_kept=len(memory.turns),
+        summary_updated=summary is not None,
+    )
     return result
@@ -0,0 +1,55 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MASTER = """
+import sys
+from faceRecModule.prefork import PreforkPool
+
+class Registry:
+    def warm_up(self):
+        return self
+
+pool = PreforkPool(2, 2, registry=Registry()).start()
+print(" ".join(str(stats.pid) for stats in pool.stats()), flush=True)
+sys.stdin.read()
+"""
+
+
+def _running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # A zombie has exited and only waits for its new parent to reap it.
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_workers_exit_when_master_is_killed():
+    master = subprocess.Popen(
+        [sys.executable, "-c", MASTER],
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=ROOT),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    pids = []
+    try:
+        pids = [int(pid) for pid in master.stdout.readline().split()]
+        assert len(pids) == 2 and all(_running(pid) for pid in pids)
+        master.send_signal(signal.SIGKILL)
+        master.wait()
+        deadline = time.monotonic() + 10
+        while any(_running(pid) for pid in pids) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not any(_running(pid) for pid in pids)
+    finally:
+        master.kill()
+        for pid in pids:
+            if _running(pid):
+                os.kill(pid, signal.SIGKILL)